@@ -0,0 +1,131 @@
+"""
+Compare CommentStore with nested comment dicts: memory, ranking/filtering operations and packing.
+
+    python bench/bench_comment_store.py --num_comments 10000 100000
+    python bench/bench_comment_store.py --no_numpy
+
+For each size a synthetic forest (split over `--threads` threads) is measured as nested
+{'id', 'text', 'score', 'replies'} dicts and as one CommentStore per thread:
+- memory retained by each form (tracemalloc), and the store's own `nbytes()`
+- top-k by score, subtree sizes and depth filtering, on dicts vs on the store
+- `pack_threads` into a budget of a quarter of the threads' size
+It also checks that `to_dicts(from_dicts(tree))` gives the tree back, ids included.
+"""
+import argparse
+import gc
+import heapq
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+os.environ.setdefault("ANTHROPIC_API_KEY", "unused")
+
+import comment_store  # noqa: E402
+import prompt_packing  # noqa: E402
+import search_reddit  # noqa: E402
+from comment_store import CommentStore  # noqa: E402
+from fixtures import make_comment_tree, plain_comments  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark CommentStore against nested comment dicts.")
+    parser.add_argument("--num_comments", type=int, nargs='+', default=[10000, 100000], help="Total comments per run (default is 10000 100000).")
+    parser.add_argument("--threads", type=int, default=10, help="Threads the comments are split over (default is 10).")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per operation; the best is reported (default is 3).")
+    parser.add_argument("--no_numpy", action="store_true", help="Time the pure-Python fallbacks.")
+    return parser.parse_args()
+
+
+def best_of(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def retained_bytes(build):
+    """ Bytes still allocated after `build()` returns, while its result is alive. """
+    gc.collect()
+    tracemalloc.start()
+    value = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, current
+
+
+def walk(forest):
+    """ (comment, depth) for every comment, parents first. """
+    stack = [(comment, 0) for comment in reversed(forest)]
+    while stack:
+        comment, depth = stack.pop()
+        yield comment, depth
+        stack.extend((reply, depth + 1) for reply in reversed(comment['replies']))
+
+
+def dict_top_k(forest, k):
+    return heapq.nlargest(k, (comment for comment, _ in walk(forest)),
+                          key=lambda comment: comment_store.parse_score(comment['score']))
+
+
+def dict_subtree_sizes(forest):
+    sizes = {}
+    order = list(walk(forest))
+    for comment, _ in reversed(order):
+        sizes[id(comment)] = 1 + sum(sizes[id(reply)] for reply in comment['replies'])
+    return sizes
+
+
+def dict_filter_depth(forest, max_depth):
+    def copy(comment, depth):
+        replies = [copy(reply, depth + 1) for reply in comment['replies']] if depth < max_depth else []
+        return {**comment, 'replies': replies}
+    return [copy(comment, 0) for comment in forest]
+
+
+def with_int_scores(forest):
+    return [{'id': c['id'], 'text': c['text'], 'score': int(c['score']), 'replies': with_int_scores(c['replies'])}
+            for c in forest]
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.no_numpy:
+        comment_store.get_numpy = prompt_packing.get_numpy = lambda: None
+    print(f"NumPy: {'off' if comment_store.get_numpy() is None else 'on'}")
+    for num_comments in args.num_comments:
+        per_thread = num_comments // args.threads
+        threads, dict_bytes = retained_bytes(lambda: [
+            plain_comments(make_comment_tree(per_thread, seed=seed)) for seed in range(args.threads)
+        ])
+        stores, store_bytes = retained_bytes(lambda: [CommentStore.from_dicts(forest) for forest in threads])
+        print(f"\n{num_comments} comments in {args.threads} threads")
+        print(f"  memory       dicts {dict_bytes / 1e6:8.1f}MB  store {store_bytes / 1e6:8.1f}MB  "
+              f"(nbytes {sum(store.nbytes() for store in stores) / 1e6:.1f}MB)")
+        operations = {
+            'top_k(50)': (lambda: [dict_top_k(forest, 50) for forest in threads],
+                          lambda: [store.top_k(50) for store in stores]),
+            'subtree sizes': (lambda: [dict_subtree_sizes(forest) for forest in threads],
+                              lambda: [store.subtree_sizes() for store in stores]),
+            'depth <= 3': (lambda: [dict_filter_depth(forest, 3) for forest in threads],
+                           lambda: [store.filter_depth(3) for store in stores]),
+        }
+        for name, (on_dicts, on_store) in operations.items():
+            print(f"  {name:<12} dicts {best_of(args.repeat, on_dicts) * 1000:8.1f}ms  "
+                  f"store {best_of(args.repeat, on_store) * 1000:8.1f}ms")
+
+        def count_tokens(text):
+            return len(text) // 4
+
+        indexed = list(enumerate(threads))
+        format_thread = search_reddit.format_reddit_thread
+        budget = sum(count_tokens(format_thread(i, forest)) for i, forest in indexed) // 4
+        seconds = best_of(args.repeat, lambda: prompt_packing.pack_threads(indexed, budget, count_tokens, format_thread))
+        print(f"  pack_threads into {budget} tokens: {seconds * 1000:8.1f}ms")
+
+        round_trip = all(store.to_dicts() == with_int_scores(forest) for store, forest in zip(stores, threads))
+        print(f"  to_dicts(from_dicts(tree)) round trip: {'ok' if round_trip else 'MISMATCH'}")
@@ -0,0 +1,69 @@
+"""
+Compare comment extraction modes on saved thread HTML.
+
+    python bench/bench_extraction.py --num_comments 1000
+    python bench/bench_extraction.py --fixture saved_thread.html
+
+Loads the page in headless Chrome and times `extract_comment_tree` in each mode: per-element
+WebDriver calls, one execute_script call, and one page_source snapshot. Without a fixture a
+synthetic thread is generated (see fixtures.py).
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+os.environ.setdefault("ANTHROPIC_API_KEY", "unused")
+
+import search_reddit  # noqa: E402
+from fixtures import count_comments, make_thread, render_thread_html  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark comment extraction modes.")
+    parser.add_argument("--fixture", type=str, help="Saved thread HTML to load instead of a synthetic thread.")
+    parser.add_argument("--num_comments", type=int, default=500, help="Size of the synthetic thread (default is 500).")
+    parser.add_argument("--modes", nargs='+', default=["element", "script", "html"], help="Extraction modes to time.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per mode; the best time is reported (default is 3).")
+    return parser.parse_args()
+
+
+def best_of(repeat, fn):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.fixture:
+        fixture_path = os.path.abspath(args.fixture)
+    else:
+        thread = make_thread(args.num_comments)
+        fd, fixture_path = tempfile.mkstemp(suffix=".html")
+        with os.fdopen(fd, 'w') as f:
+            f.write(render_thread_html(thread))
+        print(f"Generated synthetic thread with {count_comments(thread['comments'])} comments")
+
+    with open(fixture_path) as f:
+        page_html = f.read()
+    seconds, comments = best_of(args.repeat, lambda: search_reddit.extract_comments_from_html(page_html))
+    print(f"{'html (no browser)':<20} {seconds:8.3f}s  {count_comments(comments)} comments")
+
+    driver = search_reddit.setup_driver(headless=True)
+    try:
+        driver.get("file://" + fixture_path)
+        for mode in args.modes:
+            repeat = 1 if mode == "element" else args.repeat
+            seconds, comments = best_of(repeat, lambda: search_reddit.extract_comment_tree(driver, extraction_mode=mode))
+            print(f"{mode:<20} {seconds:8.3f}s  {count_comments(comments)} comments")
+    finally:
+        driver.quit()
+        if not args.fixture:
+            os.remove(fixture_path)
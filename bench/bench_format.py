@@ -0,0 +1,73 @@
+"""
+Micro-benchmark `format_comments` against the original recursive string concatenation.
+
+    python bench/bench_format.py --num_comments 10000
+
+Times both formatters on a synthetic bushy tree and on a single deep reply chain, and checks
+that their output is byte-identical. The original runs out of recursion depth on deep chains.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+os.environ.setdefault("ANTHROPIC_API_KEY", "unused")
+
+import search_reddit  # noqa: E402
+from fixtures import make_comment_tree, plain_comments  # noqa: E402
+
+
+def format_comments_recursive(comments, depth=1, include_replies=True):
+    """ The original implementation, kept here as the baseline. """
+    output = ""
+    indent = "    " * depth
+    for comment in comments:
+        output += f"{indent}- Comment: {comment['text']}\n"
+        output += f"{indent}  Score: {comment['score']}\n"
+        if comment['replies'] and include_replies:
+            output += f"{indent}  Replies:\n"
+            output += format_comments_recursive(comment['replies'], depth + 1)
+    return output
+
+
+def make_chain(num_comments):
+    root = {'text': "reply 0", 'score': "1", 'replies': []}
+    node = root
+    for i in range(1, num_comments):
+        child = {'text': f"reply {i}", 'score': "1", 'replies': []}
+        node['replies'].append(child)
+        node = child
+    return [root]
+
+
+def best_of(repeat, fn, comments):
+    best, output = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = fn(comments)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark comment formatting.")
+    parser.add_argument("--num_comments", type=int, default=10000)
+    parser.add_argument("--chain_depth", type=int, default=2000, help="Length of the deep reply chain (default is 2000).")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    trees = {
+        "bushy": plain_comments(make_comment_tree(args.num_comments, seed=0, max_depth=12)),
+        "chain": make_chain(args.chain_depth),
+    }
+    for name, comments in trees.items():
+        new_seconds, new_output = best_of(args.repeat, search_reddit.format_comments, comments)
+        try:
+            old_seconds, old_output = best_of(args.repeat, format_comments_recursive, comments)
+            old = f"{old_seconds * 1000:8.1f}ms"
+            identical = "identical" if old_output == new_output else "DIFFERENT"
+        except RecursionError:
+            old, identical = "RecursionError", "-"
+        print(f"{name:<6} {len(new_output) / 1e6:6.1f}MB  recursive {old:>14}  streaming {new_seconds * 1000:8.1f}ms  {identical}")
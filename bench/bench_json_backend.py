@@ -0,0 +1,47 @@
+"""
+Scrape fixture threads with the HTTP-only JSON backend against a local fixture server.
+
+    python bench/bench_json_backend.py
+
+Checks that `scrape_reddit_comments_json` rebuilds each fixture's full comment tree (including
+comments hidden behind "more" stubs) and reports time and request counts per thread size.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+os.environ.setdefault("ANTHROPIC_API_KEY", "unused")
+
+import search_reddit  # noqa: E402
+from fixture_server import FixtureServer  # noqa: E402
+from fixtures import THREAD_SIZES, count_comments, make_thread, plain_comments  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the JSON scraping backend against local fixtures.")
+    parser.add_argument("--visible", type=int, default=5, help="Replies per comment inlined before a 'more' stub (default is 5).")
+    return parser.parse_args()
+
+
+def with_int_scores(comments):
+    return [{'id': c['id'], 'text': c['text'], 'score': int(c['score']), 'replies': with_int_scores(c['replies'])}
+            for c in comments]
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    threads = {name: make_thread(size, seed=seed) for seed, (name, size) in enumerate(THREAD_SIZES.items())}
+    failed = False
+    with FixtureServer(list(threads.values()), visible=args.visible) as server:
+        for name, thread in threads.items():
+            before = server.request_count
+            start = time.perf_counter()
+            comments = search_reddit.scrape_reddit_comments_json(server.thread_url(thread), max_more_requests=1000)
+            elapsed = time.perf_counter() - start
+            ok = comments == with_int_scores(plain_comments(thread['comments']))
+            failed = failed or not ok
+            print(f"{name:<8} {elapsed:8.3f}s  {count_comments(comments):>5} comments  "
+                  f"{server.request_count - before:>3} requests  {'ok' if ok else 'MISMATCH'}")
+    sys.exit(1 if failed else 0)
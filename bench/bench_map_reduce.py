@@ -0,0 +1,57 @@
+"""
+Run map-reduce analysis over synthetic threads against the stub Anthropic server.
+
+    python bench/bench_map_reduce.py --num_threads 20 --latency 0.5 --rate_limit_every 7
+
+Reports wall-clock time, request count and how many requests were rate limited and retried,
+for each map concurrency level.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+os.environ.setdefault("ANTHROPIC_API_KEY", "unused")
+
+import anthropic  # noqa: E402
+import search_reddit  # noqa: E402
+from map_reduce_analysis import map_reduce_analysis  # noqa: E402
+from fixtures import make_thread, plain_comments  # noqa: E402
+from stub_anthropic import StubAnthropicServer  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark map-reduce analysis against a stub Anthropic server.")
+    parser.add_argument("--num_threads", type=int, default=20)
+    parser.add_argument("--comments_per_thread", type=int, default=300)
+    parser.add_argument("--chunk_tokens", type=int, default=4000)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--rate_limit_every", type=int, default=0)
+    parser.add_argument("--concurrency", nargs='+', type=int, default=[1, 4, 8])
+    return parser.parse_args()
+
+
+def approximate_tokens(text):
+    # Keeps the benchmark offline; tiktoken would download its encoding on first use
+    return len(text) // 4
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    threads = [
+        search_reddit.format_reddit_thread(i, plain_comments(make_thread(args.comments_per_thread, seed=i)['comments']))
+        for i in range(args.num_threads)
+    ]
+    for concurrency in args.concurrency:
+        with StubAnthropicServer(latency=args.latency, rate_limit_every=args.rate_limit_every) as server:
+            client = anthropic.Anthropic(api_key="stub", base_url=server.base_url)
+            start = time.perf_counter()
+            ranking = map_reduce_analysis(
+                client, "best things", threads, approximate_tokens, "stub-model",
+                chunk_tokens=args.chunk_tokens, reduce_tokens=args.chunk_tokens, concurrency=concurrency,
+            )
+            elapsed = time.perf_counter() - start
+            print(f"concurrency {concurrency:>2}: {elapsed:7.2f}s  {server.request_count} requests  "
+                  f"{server.rate_limited} rate limited")
+    print(ranking)
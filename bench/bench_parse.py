@@ -0,0 +1,70 @@
+"""
+Compare the post title/body extraction paths on saved or synthetic Reddit pages.
+
+    python bench/bench_parse.py
+    python bench/bench_parse.py --html_dir ~/saved_reddit_pages
+
+Times each parser in `post_parsing` ("soup" is the original full html.parser tree) and
+reports peak Python memory via tracemalloc, then checks that all paths agree. Note that
+tracemalloc does not see libxml2's own allocations, so the lxml peak only covers the
+Python objects it creates.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+
+import post_parsing  # noqa: E402
+from fixtures import THREAD_SIZES, make_thread, render_thread_html  # noqa: E402
+
+
+def load_pages(html_dir):
+    if html_dir:
+        pages = {}
+        for path in sorted(glob.glob(os.path.join(os.path.expanduser(html_dir), "*.html"))):
+            with open(path, encoding="utf-8") as f:
+                pages[os.path.basename(path)] = f.read()
+        return pages
+    return {name: render_thread_html(make_thread(size, seed=seed)) for seed, (name, size) in enumerate(THREAD_SIZES.items())}
+
+
+def measure(parser, html, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = post_parsing.parse_post_title_and_body(html, parser)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    post_parsing.parse_post_title_and_body(html, parser)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark post title/body extraction.")
+    parser.add_argument("--html_dir", help="Directory of saved Reddit post pages (*.html); synthetic fixtures by default.")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    parsers = ["soup", "strainer"] + (["lxml"] if post_parsing.HAVE_LXML else [])
+    pages = load_pages(args.html_dir)
+    if not pages:
+        sys.exit(f"No *.html files found in {args.html_dir}")
+    failed = False
+    for name, html in pages.items():
+        results = {}
+        line = [f"{name:<24} {len(html) / 1e6:6.2f}MB"]
+        for parser_name in parsers:
+            seconds, peak, results[parser_name] = measure(parser_name, html, args.repeat)
+            line.append(f"{parser_name} {seconds * 1000:7.1f}ms {peak / 1e3:8.0f}KB")
+        agree = all(result == results["soup"] for result in results.values())
+        failed = failed or not agree
+        line.append("ok" if agree else "MISMATCH")
+        print("  ".join(line))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,87 @@
+"""
+Compare refreshing known threads against their snapshots with scraping them again in full.
+
+    python bench/bench_refresh.py --num_threads 50 --new_comments 20
+
+Scrapes fixture threads once with the JSON backend, which caches their comment trees (the
+snapshots) in a temporary cache. Then it adds comments and changes some scores on every thread (see
+`fixtures.grow_thread`) and times two ways of picking up the changes: a full re-scrape, and
+`scrape_thread_comments(..., refresh=True)`. Both must find the same comments, and the
+refresh must find every new one. Scores of collapsed comments reused from the snapshot can
+lag behind, and the script reports how many do.
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+os.environ.setdefault("ANTHROPIC_API_KEY", "unused")
+
+import search_reddit  # noqa: E402
+from http_fetch import Fetcher  # noqa: E402
+from reddit_cache import PersistentCache  # noqa: E402
+from thread_snapshots import format_refresh_counts, index_snapshot  # noqa: E402
+from fixture_server import FixtureServer  # noqa: E402
+from fixtures import THREAD_SIZES, grow_thread, make_thread  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark incremental thread refreshes against full re-scrapes.")
+    parser.add_argument("--num_threads", type=int, default=50, help="Known threads to refresh (default is 50).")
+    parser.add_argument("--size", choices=list(THREAD_SIZES), default="medium", help="Fixture thread size (default is medium).")
+    parser.add_argument("--new_comments", type=int, default=20, help="Comments added to each thread before the refresh (default is 20).")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds the fixture server waits before each response (default is 0.02).")
+    return parser.parse_args()
+
+
+def timed_scrapes(server, urls, scrape):
+    """ Scrape every URL with a fresh HTTP memo; returns (seconds, requests, {url: comments}). """
+    search_reddit.http = Fetcher(headers=search_reddit.REDDIT_HEADERS, profiler=search_reddit.profiler)
+    before = server.request_count
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        trees = {url: scrape(url) for url in urls}
+    return time.perf_counter() - start, server.request_count - before, trees
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    threads = [make_thread(THREAD_SIZES[args.size], seed=seed) for seed in range(args.num_threads)]
+    with tempfile.TemporaryDirectory() as tmp, FixtureServer(threads, latency=args.latency) as server:
+        search_reddit.cache = PersistentCache(os.path.join(tmp, "cache.sqlite3"))
+        urls = [server.thread_url(thread) for thread in threads]
+        seconds, requests, _ = timed_scrapes(server, urls, lambda url: search_reddit.scrape_thread_comments(url, "json"))
+        print(f"{'initial scrape':<16} {seconds:8.3f}s  {requests:>5} requests")
+
+        new_ids = set()
+        for seed, thread in enumerate(threads):
+            new_ids.update(grow_thread(thread, args.new_comments, seed=seed))
+
+        full_seconds, full_requests, full = timed_scrapes(
+            server, urls, lambda url: search_reddit.scrape_reddit_comments_json(url, max_more_requests=1000))
+        print(f"{'full re-scrape':<16} {full_seconds:8.3f}s  {full_requests:>5} requests")
+        search_reddit.refresh_counts.clear()
+        refresh_seconds, refresh_requests, refreshed = timed_scrapes(
+            server, urls, lambda url: search_reddit.scrape_thread_comments(url, "json", refresh=True))
+        print(f"{'refresh':<16} {refresh_seconds:8.3f}s  {refresh_requests:>5} requests  "
+              f"({refresh_seconds / full_seconds:.0%} of the full re-scrape's time)")
+        print(f"refresh: {format_refresh_counts(search_reddit.refresh_counts)}")
+
+    failed = False
+    stale_scores = 0
+    for url in urls:
+        expected, actual = index_snapshot(full[url]), index_snapshot(refreshed[url])
+        if set(expected) != set(actual) or any(expected[name][1] != actual[name][1] for name in expected):
+            print(f"MISMATCH {url}: {len(set(expected) ^ set(actual))} comments differ or moved")
+            failed = True
+        stale_scores += sum(1 for name in expected if name in actual and expected[name][0]['score'] != actual[name][0]['score'])
+    missing = new_ids - {name for tree in refreshed.values() for name in index_snapshot(tree)}
+    if missing:
+        print(f"{len(missing)} new comments were not found by the refresh")
+        failed = True
+    print(f"{stale_scores} reused comments kept a stale score")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,104 @@
+"""
+Measure the CLI's startup cost for each entry path, optionally against an older revision.
+
+    python bench/bench_startup.py
+    python bench/bench_startup.py --baseline_ref HEAD~1
+
+Every path runs in a fresh interpreter with no Google or Anthropic credentials set:
+- import: `import search_reddit`, as a worker process importing the scraping helpers would
+- help: `search_reddit.py --help`
+- replay: `search_reddit.py --cache_prompt <prompt> --no_cache`, answered by the stub
+  Anthropic server (the only path given an API key)
+
+import and help are timed again as "+key" with a dummy API key, so revisions that need
+one at import time can still be compared.
+
+Reports the best wall time of `--repeat` runs, or how the path failed. With
+`--baseline_ref`, that revision's bin/ is extracted with `git archive` and timed the same way.
+"""
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "bin"))
+
+import search_reddit  # noqa: E402
+from fixtures import make_thread, plain_comments  # noqa: E402
+from stub_anthropic import StubAnthropicServer  # noqa: E402
+
+CREDENTIALS = ("ANTHROPIC_API_KEY", "ANTHROPIC_BASE_URL", "GOOGLE_SEARCH_API_KEY", "GOOGLE_SEARCH_CSE_ID")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark CLI startup time per entry path.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline_ref", type=str, help="Git revision to compare against, e.g. HEAD~1.")
+    parser.add_argument("--token_counter", choices=["tiktoken", "anthropic"], default="anthropic",
+                        help="--token_counter for the replay path (default is anthropic, which the stub answers offline).")
+    return parser.parse_args()
+
+
+def extract_bin(ref, directory):
+    archive = subprocess.run(["git", "-C", REPO_DIR, "archive", "--format=tar", ref, "bin"],
+                             check=True, capture_output=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(directory)
+    return os.path.join(directory, "bin")
+
+
+def time_command(command, cwd, env, repeat):
+    """ Best wall time of `repeat` runs, or the last line of stderr if the command fails. """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            lines = result.stderr.strip().splitlines()
+            return None, lines[-1] if lines else f"exit status {result.returncode}"
+        best = elapsed if best is None else min(best, elapsed)
+    return best, None
+
+
+def startup_paths(prompt_path, token_counter, stub_url):
+    """ name -> (command, extra environment) """
+    import_command = [sys.executable, "-c", "import search_reddit"]
+    help_command = [sys.executable, "search_reddit.py", "--help"]
+    dummy_key = {'ANTHROPIC_API_KEY': "unused"}
+    return {
+        'import': (import_command, {}),
+        'import+key': (import_command, dummy_key),
+        'help': (help_command, {}),
+        'help+key': (help_command, dummy_key),
+        'replay': ([sys.executable, "search_reddit.py", "--cache_prompt", prompt_path, "--no_cache",
+                    "--token_counter", token_counter], {'ANTHROPIC_API_KEY': "stub", 'ANTHROPIC_BASE_URL': stub_url}),
+    }
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    base_env = {key: value for key, value in os.environ.items() if key not in CREDENTIALS}
+    with tempfile.TemporaryDirectory() as tmp, StubAnthropicServer() as llm:
+        prompt_path = os.path.join(tmp, "prompt.txt")
+        thread = make_thread(200, seed=0)
+        with open(prompt_path, 'w') as f:
+            f.write(search_reddit.build_analysis_prompt(
+                "bench query", [search_reddit.format_reddit_thread(0, plain_comments(thread['comments']))]
+            ))
+        trees = {'current': os.path.join(REPO_DIR, "bin")}
+        if args.baseline_ref:
+            trees[args.baseline_ref] = extract_bin(args.baseline_ref, os.path.join(tmp, "baseline"))
+        for path_name, (command, extra_env) in startup_paths(prompt_path, args.token_counter, llm.base_url).items():
+            env = {**base_env, **extra_env}
+            line = [f"{path_name:<12}"]
+            for tree_name, tree in trees.items():
+                seconds, error = time_command(command, tree, env, args.repeat)
+                line.append(f"{tree_name} {seconds * 1000:8.1f}ms" if error is None else f"{tree_name} fails: {error[:60]}")
+            print("  ".join(line))
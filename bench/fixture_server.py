@@ -0,0 +1,124 @@
+"""
+Local HTTP server that serves fixture threads the way reddit.com does:
+
+    /r/bench/comments/<post_id>/<slug>/        thread HTML
+    /r/bench/comments/<post_id>/<slug>.json    thread JSON (with "more" stubs)
+    /api/morechildren.json                     expansion of "more" stubs
+    /customsearch/v1                           Custom Search stand-in listing every thread
+
+Run it directly to browse the fixtures, or use FixtureServer from other bench scripts.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from fixtures import THREAD_SIZES, make_thread, morechildren_json, render_thread_html, render_thread_json
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    server_version = "FixtureServer/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_body(self, body, content_type, status=200):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, payload, status=200):
+        self.send_body(json.dumps(payload), "application/json", status)
+
+    def send_search_page(self, params):
+        # Every query matches all threads, in the order they were given
+        start = int(params.get('start', ["1"])[0])
+        num = int(params.get('num', ["10"])[0])
+        links = list(self.server.thread_urls.values())[start - 1:start - 1 + num]
+        return self.send_json({'items': [{'link': link, 'title': link} for link in links]})
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        params = parse_qs(parsed.query)
+        self.server.request_count += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if parsed.path == "/customsearch/v1":
+            return self.send_search_page(params)
+        if parsed.path == "/api/morechildren.json":
+            thread = self.server.threads.get(params.get('link_id', [""])[0][3:])
+            if thread is None:
+                return self.send_json({'error': 404}, 404)
+            children_ids = params.get('children', [""])[0].split(",")
+            return self.send_json(morechildren_json(thread, children_ids))
+        parts = parsed.path.strip("/").split("/")
+        if len(parts) >= 4 and parts[0] == "r" and parts[2] == "comments":
+            thread = self.server.threads.get(parts[3])
+            if thread is not None:
+                if parsed.path.endswith(".json"):
+                    return self.send_json(render_thread_json(thread, visible=self.server.visible))
+                return self.send_body(render_thread_html(thread), "text/html; charset=utf-8")
+        self.send_json({'error': 404}, 404)
+
+
+class FixtureServer:
+    """ Serve fixture threads from a background thread: `with FixtureServer(threads) as server: ...` """
+
+    def __init__(self, threads, port=0, visible=5, latency=0.0, verbose=False):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), FixtureHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.threads = {thread['post_id']: thread for thread in threads}
+        self.httpd.thread_urls = {thread['post_id']: self.thread_url(thread) for thread in threads}
+        self.httpd.visible = visible
+        self.httpd.latency = latency
+        self.httpd.verbose = verbose
+        self.httpd.request_count = 0
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def request_count(self):
+        return self.httpd.request_count
+
+    @property
+    def search_url(self):
+        return f"{self.base_url}/customsearch/v1"
+
+    def thread_url(self, thread):
+        return f"{self.base_url}/r/bench/comments/{thread['post_id']}/fixture_thread/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve synthetic Reddit thread fixtures.")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    threads = [make_thread(size, seed=seed) for seed, size in enumerate(THREAD_SIZES.values())]
+    server = FixtureServer(threads, port=args.port, verbose=True)
+    for name, thread in zip(THREAD_SIZES, threads):
+        print(f"{name:<8} {server.thread_url(thread)}")
+    server.httpd.serve_forever()
@@ -0,0 +1,214 @@
+"""
+Synthetic Reddit thread fixtures for the benchmarks in this directory.
+
+Threads are generated deterministically from a seed so that runs are comparable. The HTML
+mirrors the parts of the shreddit markup the scraper relies on (shreddit-title, the
+`-post-rtjson-content` body div and nested shreddit-comment elements).
+"""
+import html
+import random
+
+
+THREAD_SIZES = {
+    "small": 50,
+    "medium": 500,
+    "large": 2000,
+}
+
+WORDS = """
+the a this that really best worst think great love hate recommend try avoid first second
+book show movie wine pizza coffee hike trail park beach city trip price quality value
+honestly definitely probably never always sometimes season series author episode bottle
+""".split()
+
+
+def make_text(rng, min_words=5, max_words=60):
+    paragraphs = []
+    for _ in range(rng.choice([1, 1, 1, 2, 3])):
+        words = rng.choices(WORDS, k=rng.randint(min_words, max_words))
+        paragraphs.append(" ".join(words).capitalize() + ".")
+    return "\n".join(paragraphs)
+
+
+def make_comment_tree(num_comments, seed=0, max_depth=8):
+    """
+    Build a random comment tree.
+    Returns:
+    - list: Root comments as {'id', 'text', 'score', 'replies'} dicts, scores as ints.
+    """
+    rng = random.Random(seed)
+    roots = []
+    open_nodes = []  # (comment, depth) pairs that can still receive replies
+    for i in range(num_comments):
+        comment = {
+            'id': f"t1_{seed:x}c{i:x}",
+            'text': make_text(rng),
+            'score': int(rng.paretovariate(1.2)) - rng.randint(0, 3),
+            'replies': [],
+        }
+        if not open_nodes or rng.random() < 0.3:
+            roots.append(comment)
+            depth = 0
+        else:
+            parent, parent_depth = rng.choice(open_nodes[-50:])
+            parent['replies'].append(comment)
+            depth = parent_depth + 1
+        if depth < max_depth:
+            open_nodes.append((comment, depth))
+    return roots
+
+
+def make_thread(num_comments, seed=0):
+    rng = random.Random(seed)
+    return {
+        'post_id': f"p{seed:x}",
+        'title': make_text(rng, 4, 12).split("\n")[0],
+        'body': make_text(rng, 20, 120),
+        'comments': make_comment_tree(num_comments, seed=seed),
+    }
+
+
+def grow_thread(thread, num_new, seed=0, rescore_fraction=0.1):
+    """
+    Simulate a day of activity on a fixture thread in place: `num_new` comments are added
+    (as roots or replies to random comments) and a fraction of the existing scores change.
+    Returns the ids of the new comments.
+    """
+    rng = random.Random(seed)
+    existing = []
+    stack = list(thread['comments'])
+    while stack:
+        comment = stack.pop()
+        existing.append(comment)
+        stack.extend(comment['replies'])
+    for comment in existing:
+        if rng.random() < rescore_fraction:
+            comment['score'] += rng.randint(1, 20)
+    new_ids = []
+    for i in range(num_new):
+        comment = {'id': f"t1_{thread['post_id']}n{seed:x}x{i:x}", 'text': make_text(rng),
+                   'score': rng.randint(1, 5), 'replies': []}
+        if not existing or rng.random() < 0.3:
+            thread['comments'].append(comment)
+        else:
+            rng.choice(existing)['replies'].append(comment)
+        existing.append(comment)
+        new_ids.append(comment['id'])
+    return new_ids
+
+
+def plain_comments(comments):
+    """ Strip a fixture tree down to the {'id','text','score','replies'} form the scraper returns. """
+    return [
+        {'id': c['id'], 'text': c['text'], 'score': str(c['score']), 'replies': plain_comments(c['replies'])}
+        for c in comments
+    ]
+
+
+def count_comments(comments):
+    return sum(1 + count_comments(c['replies']) for c in comments)
+
+
+def _render_comment(comment, depth, parent_id, out):
+    slot = f' slot="children-{parent_id}-0"' if parent_id else ""
+    out.append(
+        f'<shreddit-comment thingid="{comment["id"]}" depth="{depth}" score="{comment["score"]}"{slot}>'
+        f'<div slot="commentMeta"><a href="/user/someone">someone</a></div>'
+        f'<div slot="comment" id="{comment["id"]}-comment-rtjson-content">'
+    )
+    for paragraph in comment['text'].split("\n"):
+        out.append(f"<p>{html.escape(paragraph)}</p>")
+    out.append("</div>")
+    for reply in comment['replies']:
+        _render_comment(reply, depth + 1, comment['id'], out)
+    out.append("</shreddit-comment>")
+
+
+def render_thread_html(thread):
+    """ Render a fixture thread as a (heavily simplified) expanded shreddit page. """
+    post_id = thread['post_id']
+    out = [
+        "<!DOCTYPE html><html><head><title>fixture</title></head><body>",
+        f'<shreddit-title title="{html.escape(thread["title"])}"></shreddit-title>',
+        f'<shreddit-post id="t3_{post_id}">',
+        f'<div id="t3_{post_id}-post-rtjson-content">',
+    ]
+    for paragraph in thread['body'].split("\n"):
+        out.append(f"<p>{html.escape(paragraph)}</p>")
+    out.append("</div></shreddit-post>")
+    out.append(f'<shreddit-comment-tree post-id="t3_{post_id}">')
+    for comment in thread['comments']:
+        _render_comment(comment, 0, None, out)
+    out.append("</shreddit-comment-tree></body></html>")
+    return "".join(out)
+
+
+def _descendant_ids(comments):
+    ids = []
+    for comment in comments:
+        ids.append(comment['id'][3:])
+        ids.extend(_descendant_ids(comment['replies']))
+    return ids
+
+
+def _comment_thing(comment, parent_name, link_id, depth, replies):
+    return {'kind': 't1', 'data': {
+        'id': comment['id'][3:],
+        'name': comment['id'],
+        'parent_id': parent_name,
+        'link_id': link_id,
+        'depth': depth,
+        'body': comment['text'],
+        'score': comment['score'],
+        'replies': replies,
+    }}
+
+
+def _comment_listing(comments, parent_name, link_id, depth, visible):
+    children = []
+    for comment in comments[:visible]:
+        replies = _comment_listing(comment['replies'], comment['id'], link_id, depth + 1, visible)
+        children.append(_comment_thing(comment, parent_name, link_id, depth, replies))
+    hidden = _descendant_ids(comments[visible:])
+    if hidden:
+        children.append({'kind': 'more', 'data': {
+            'id': hidden[0], 'name': f"t1_{hidden[0]}", 'parent_id': parent_name,
+            'depth': depth, 'count': len(hidden), 'children': hidden,
+        }})
+    if not children:
+        return ""
+    return {'kind': 'Listing', 'data': {'children': children}}
+
+
+def render_thread_json(thread, visible=5):
+    """
+    Render a fixture thread like Reddit's `<thread>.json`: only the first `visible` replies
+    of every comment (and the first `visible` root comments) are inline, the rest sit
+    behind "more" stubs that must be expanded via `morechildren_json`.
+    """
+    link_id = f"t3_{thread['post_id']}"
+    post = {'kind': 'Listing', 'data': {'children': [{'kind': 't3', 'data': {
+        'id': thread['post_id'], 'name': link_id, 'title': thread['title'], 'selftext': thread['body'],
+    }}]}}
+    comments = _comment_listing(thread['comments'], link_id, link_id, 0, visible) or {
+        'kind': 'Listing', 'data': {'children': []}}
+    return [post, comments]
+
+
+def morechildren_json(thread, children_ids):
+    """ Answer /api/morechildren for a fixture thread: the requested comments, flat, parents first. """
+    link_id = f"t3_{thread['post_id']}"
+    index = {}
+
+    def walk(comments, parent_name, depth):
+        for comment in comments:
+            index[comment['id'][3:]] = (comment, parent_name, depth)
+            walk(comment['replies'], comment['id'], depth + 1)
+
+    walk(thread['comments'], link_id, 0)
+    things = []
+    for child_id in children_ids:
+        if child_id in index:
+            comment, parent_name, depth = index[child_id]
+            things.append(_comment_thing(comment, parent_name, link_id, depth, ""))
+    return {'json': {'errors': [], 'data': {'things': things}}}
@@ -0,0 +1,218 @@
+"""
+Offline benchmark suite: per-function and end-to-end timings and memory, compared to a baseline.
+
+    python bench/run_benchmarks.py --save_baseline     # record bench/baseline.json
+    python bench/run_benchmarks.py                     # compare against it
+
+Everything runs against local stand-ins, so results are reproducible and nothing hits the
+network. The fixture server serves thread HTML and JSON for deterministic fixture threads
+of every size in `fixtures.THREAD_SIZES`, along with a Custom Search endpoint that lists
+them. The stub Anthropic server answers the relevance and analysis calls after
+`--llm_latency` seconds.
+
+Per-function benchmarks cover post parsing, HTML comment extraction, the JSON scrape,
+`format_comments` and `calculate_token_count` for each thread size. End-to-end benchmarks run
+`reddit_to_llm` (serial and `--concurrent`, JSON backend) plus the analysis call, and
+break the time down by profiling stage. Each result is the best of `--repeat` runs, with
+peak traced memory from one more run. A metric counts as a regression when it is more than
+`--tolerance` worse than the baseline; the exit status is 1 when any regressed.
+
+The browser extraction modes need Chrome and are benchmarked separately by
+bench_extraction.py.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+os.environ.setdefault("ANTHROPIC_API_KEY", "unused")
+
+import anthropic  # noqa: E402
+import search_reddit  # noqa: E402
+from http_fetch import Fetcher  # noqa: E402
+from post_parsing import parse_post_title_and_body  # noqa: E402
+from profiling import Profiler  # noqa: E402
+from token_counting import TokenCounter  # noqa: E402
+from fixture_server import FixtureServer  # noqa: E402
+from fixtures import THREAD_SIZES, make_thread, plain_comments, render_thread_html  # noqa: E402
+from stub_anthropic import StubAnthropicServer  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+class ApproximateTokenCounter(TokenCounter):
+    """ Keeps the suite offline; tiktoken would download its encoding on first use. """
+
+    def _count_uncached(self, text):
+        return len(text) // 4
+
+    def count_batch(self, texts):
+        return [self.count(text) for text in texts]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite.")
+    parser.add_argument("--sizes", nargs='+', choices=list(THREAD_SIZES), default=list(THREAD_SIZES), help="Fixture thread sizes to include (default is all).")
+    parser.add_argument("--threads_per_size", type=int, default=2, help="Fixture threads of each size in the end-to-end runs (default is 2).")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark; the best is reported (default is 3).")
+    parser.add_argument("--llm_latency", type=float, default=0.05, help="Seconds the stub Anthropic server waits before each reply (default is 0.05).")
+    parser.add_argument("--http_latency", type=float, default=0.0, help="Seconds the fixture server waits before each response (default is 0).")
+    parser.add_argument("--token_counter", choices=["approximate", "tiktoken"], default="approximate", help="Token counting backend (default approximates offline).")
+    parser.add_argument("--baseline", type=str, default=DEFAULT_BASELINE, help=f"Baseline results file (default is {DEFAULT_BASELINE}).")
+    parser.add_argument("--save_baseline", action="store_true", help="Store this run as the new baseline instead of comparing.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown or memory growth before a metric is flagged (default is 0.25).")
+    parser.add_argument("--report", type=str, help="Also write this run's results to this JSON file.")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output.")
+    return parser.parse_args()
+
+
+def measure(fn, repeat, setup=None):
+    """ Best wall time of `repeat` runs, then peak traced memory of one more run. """
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': best, 'peak_kb': peak / 1e3}
+
+
+def reset_pipeline(token_counter_backend):
+    """ Fresh profiler, HTTP memo and token memo, so repeated runs do the same work. """
+    search_reddit.profiler = Profiler()
+    search_reddit.http = Fetcher(headers=search_reddit.REDDIT_HEADERS, profiler=search_reddit.profiler)
+    search_reddit.token_counter = ApproximateTokenCounter() if token_counter_backend == "approximate" else TokenCounter()
+    search_reddit.cache = None
+
+
+def function_benchmarks(args, server, threads):
+    results = {}
+    for name in args.sizes:
+        thread = threads[name][0]
+        html = render_thread_html(thread)
+        comments = plain_comments(thread['comments'])
+        formatted = search_reddit.format_comments(comments)
+        url = server.thread_url(thread)
+        benchmarks = {
+            'parse_post_title_and_body': (lambda: parse_post_title_and_body(html), None),
+            'extract_comments_from_html': (lambda: search_reddit.extract_comments_from_html(html), None),
+            'scrape_reddit_comments_json': (lambda: search_reddit.scrape_reddit_comments_json(url, max_more_requests=1000),
+                                            lambda: reset_pipeline(args.token_counter)),
+            'format_comments': (lambda: search_reddit.format_comments(comments), None),
+            'calculate_token_count': (lambda: search_reddit.calculate_token_count(formatted),
+                                      lambda: reset_pipeline(args.token_counter)),
+        }
+        for function, (fn, setup) in benchmarks.items():
+            results[f"{function}[{name}]"] = measure(fn, args.repeat, setup=setup)
+    return results
+
+
+def end_to_end_benchmarks(args, server, num_threads):
+    def run(concurrent):
+        prompt = search_reddit.reddit_to_llm(
+            search_query="bench query", num_links_from_search=num_threads, concurrent=concurrent,
+            scrape_backend="json", domain_delay=0.0,
+        )
+        with search_reddit.profiler.span('analysis_llm', model=search_reddit.ANALYSIS_MODEL):
+            search_reddit.client.messages.create(
+                model=search_reddit.ANALYSIS_MODEL, max_tokens=1000, temperature=0.0,
+                messages=[{"role": "user", "content": prompt}],
+            )
+
+    results = {}
+    for name, concurrent in (("reddit_to_llm[serial]", False), ("reddit_to_llm[concurrent]", True)):
+        result = measure(lambda: run(concurrent), args.repeat, setup=lambda: reset_pipeline(args.token_counter))
+        # Stage breakdown of an untraced run
+        reset_pipeline(args.token_counter)
+        run(concurrent)
+        result['stages'] = {stage: totals['total_seconds'] for stage, totals in search_reddit.profiler.stages().items()}
+        results[name] = result
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """ Print each metric next to its baseline; returns the names of regressed metrics. """
+    regressions = []
+    for name, result in results.items():
+        line = [f"{name:<44}"]
+        for metric, unit, scale, noise in (('seconds', "ms", 1000, 0.002), ('peak_kb', "KB", 1, 64)):
+            value = result[metric] * scale
+            previous = baseline.get(name, {}).get(metric)
+            if previous is None:
+                line.append(f"{value:10.1f}{unit}            ")
+                continue
+            ratio = result[metric] / previous if previous else float("inf")
+            # Differences below `noise` (2ms, 64KB) are never flagged
+            flag = " !" if ratio > 1 + tolerance and result[metric] - previous > noise else "  "
+            if flag.strip():
+                regressions.append(f"{name} {metric}")
+            line.append(f"{value:10.1f}{unit} {ratio:6.2f}x{flag}")
+        print(" ".join(line))
+    return regressions
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    threads = {
+        name: [make_thread(THREAD_SIZES[name], seed=seed * 100 + i) for i in range(args.threads_per_size)]
+        for seed, name in enumerate(args.sizes)
+    }
+    all_threads = [thread for size_threads in threads.values() for thread in size_threads]
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with FixtureServer(all_threads, latency=args.http_latency) as server, \
+            StubAnthropicServer(latency=args.llm_latency) as llm:
+        search_reddit.client = anthropic.Anthropic(api_key="stub", base_url=llm.base_url)
+        search_reddit.GOOGLE_SEARCH_URL = server.search_url
+        search_reddit.GOOGLE_SEARCH_API_KEY = search_reddit.GOOGLE_SEARCH_CSE_ID = "bench"
+        search_reddit.REDDIT_URL_MARKER = "/r/bench/comments/"
+        # The serial path's random 1-2s politeness pause per thread would swamp everything else
+        search_reddit.sleep = lambda seconds: None
+        reset_pipeline(args.token_counter)
+        with output:
+            results = function_benchmarks(args, server, threads)
+            results.update(end_to_end_benchmarks(args, server, len(all_threads)))
+
+    run = {
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('baseline', 'save_baseline', 'report', 'verbose')},
+        'results': results,
+    }
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline_run = json.load(f)
+        if baseline_run.get('config') != run['config']:
+            print(f"Warning: {args.baseline} was recorded with a different configuration: {baseline_run.get('config')}")
+        baseline = baseline_run['results']
+        print(f"Compared to {args.baseline} ({baseline_run['timestamp']}):")
+    regressions = compare(results, baseline, args.tolerance)
+    for name, result in results.items():
+        if 'stages' in result:
+            stages = sorted(result['stages'].items(), key=lambda item: item[1], reverse=True)
+            print(f"{name} stages: " + ", ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in stages))
+    for path in [args.report] + ([args.baseline] if args.save_baseline else []):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(run, f, indent=2)
+            print(f"Results written to {path}")
+    if regressions:
+        print(f"{len(regressions)} regressions beyond {args.tolerance:.0%}: " + ", ".join(regressions))
+        sys.exit(1)
@@ -0,0 +1,166 @@
+"""
+Local stand-in for the Anthropic Messages API (POST /v1/messages and /v1/messages/count_tokens).
+
+Replies are canned but shaped like the real thing: relevance checks get YES/NO verdicts,
+everything else gets a small ranking. Latency and rate limiting (HTTP 429 with
+Retry-After on every Nth request) are configurable so retry and concurrency behaviour can
+be exercised offline. Streaming requests get server-sent events with a per-token delay. Point a client at it with
+`anthropic.Anthropic(api_key="stub", base_url=server.base_url)`.
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def stub_reply(prompt):
+    batch = re.findall(r"^\s*THREAD (\d+):", prompt, re.MULTILINE)
+    if batch:
+        return "\n".join(f"{number}: YES" for number in batch)
+    if "YES or NO" in prompt:
+        return "YES"
+    if "<element> | <mentions>" in prompt and "Rankings" not in prompt:
+        return "\n".join(f"element {i} | {10 - i} | {100 * (10 - i)} | 0.5" for i in range(5))
+    return "**Rankings**:\n" + "\n".join(f"- element {i}: {1 - i / 10:.1f}" for i in range(5))
+
+
+class StubAnthropicHandler(BaseHTTPRequestHandler):
+    server_version = "StubAnthropic/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, payload, status=200, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_event(self, event, payload):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def send_stream(self, body, request_number, prompt, text):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        tokens = re.findall(r"\S+\s*", text)
+        self.send_event("message_start", {'type': 'message_start', 'message': {
+            'id': f"msg_stub_{request_number}", 'type': 'message', 'role': 'assistant',
+            'model': body.get('model', 'stub'), 'content': [], 'stop_reason': None, 'stop_sequence': None,
+            'usage': {'input_tokens': len(prompt) // 4, 'output_tokens': 0},
+        }})
+        self.send_event("content_block_start", {'type': 'content_block_start', 'index': 0,
+                                                'content_block': {'type': 'text', 'text': ""}})
+        for token in tokens:
+            time.sleep(self.server.token_latency)
+            self.send_event("content_block_delta", {'type': 'content_block_delta', 'index': 0,
+                                                    'delta': {'type': 'text_delta', 'text': token}})
+        self.send_event("content_block_stop", {'type': 'content_block_stop', 'index': 0})
+        self.send_event("message_delta", {'type': 'message_delta',
+                                          'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                                          'usage': {'output_tokens': len(tokens)}})
+        self.send_event("message_stop", {'type': 'message_stop'})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with self.server.lock:
+            self.server.request_count += 1
+            request_number = self.server.request_count
+        path = self.path.split("?")[0]
+        if path == "/v1/messages/count_tokens":
+            prompt = json.dumps(body.get('messages', []))
+            return self.send_json({'input_tokens': len(prompt) // 4})
+        if path != "/v1/messages":
+            return self.send_json({'type': 'error', 'error': {'type': 'not_found_error', 'message': self.path}}, 404)
+        if self.server.rate_limit_every and request_number % self.server.rate_limit_every == 0:
+            self.server.rate_limited += 1
+            return self.send_json(
+                {'type': 'error', 'error': {'type': 'rate_limit_error', 'message': 'stub rate limit'}},
+                429, {'retry-after': str(self.server.retry_after)},
+            )
+        time.sleep(self.server.latency)
+        prompt = "".join(
+            message['content'] if isinstance(message['content'], str)
+            else "".join(block.get('text', "") for block in message['content'])
+            for message in body.get('messages', [])
+        )
+        text = stub_reply(prompt)
+        if body.get('stream'):
+            return self.send_stream(body, request_number, prompt, text)
+        self.send_json({
+            'id': f"msg_stub_{request_number}",
+            'type': 'message',
+            'role': 'assistant',
+            'model': body.get('model', 'stub'),
+            'content': [{'type': 'text', 'text': text}],
+            'stop_reason': 'end_turn',
+            'stop_sequence': None,
+            'usage': {'input_tokens': len(prompt) // 4, 'output_tokens': len(text) // 4},
+        })
+
+
+class StubAnthropicServer:
+    """ Serve the stub from a background thread: `with StubAnthropicServer(latency=0.5) as server: ...` """
+
+    def __init__(self, port=0, latency=0.0, token_latency=0.0, rate_limit_every=0, retry_after=0.1, verbose=False):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), StubAnthropicHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.token_latency = token_latency
+        self.httpd.rate_limit_every = rate_limit_every
+        self.httpd.retry_after = retry_after
+        self.httpd.verbose = verbose
+        self.httpd.lock = threading.Lock()
+        self.httpd.request_count = 0
+        self.httpd.rate_limited = 0
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def request_count(self):
+        return self.httpd.request_count
+
+    @property
+    def rate_limited(self):
+        return self.httpd.rate_limited
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stub Anthropic Messages API server.")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds to wait before each reply.")
+    parser.add_argument("--token_latency", type=float, default=0.02, help="Seconds between streamed tokens.")
+    parser.add_argument("--rate_limit_every", type=int, default=0, help="Answer every Nth request with a 429.")
+    args = parser.parse_args()
+    server = StubAnthropicServer(port=args.port, latency=args.latency, token_latency=args.token_latency,
+                                 rate_limit_every=args.rate_limit_every, verbose=True)
+    print(f"Stub Anthropic API on {server.base_url} (ANTHROPIC_BASE_URL={server.base_url})")
+    server.httpd.serve_forever()
@@ -0,0 +1,212 @@
+"""
+Compact columnar storage for scraped comment trees.
+
+A CommentStore keeps a whole tree (or forest) as parallel arrays in pre-order: parent index,
+depth and numeric score per comment, plus all comment texts in one shared string buffer and
+the Reddit ids that snapshots rely on. Because of the pre-order layout every subtree is a
+contiguous range, which keeps ranking and filtering cheap. pack_threads (prompt_packing.py)
+ranks and selects comments on stores. With NumPy installed, top_k, subtree_sizes and
+select/filter_depth are vectorized (NumPy is only imported the first time one of them
+runs); without it they fall back to per-comment loops.
+"""
+import heapq
+from array import array
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def get_numpy():
+    try:
+        import numpy
+    except ImportError:  # Optional: everything falls back to pure Python
+        return None
+    return numpy
+
+
+def parse_score(score):
+    """ Scores come back as strings from the browser and ints from the JSON backend. """
+    try:
+        return int(score)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _to_array(typecode, values):
+    """ NumPy integers -> array(typecode), for the columns a store keeps. """
+    result = array(typecode)
+    result.frombytes(values.astype(f"i{result.itemsize}").tobytes())
+    return result
+
+
+class CommentStore:
+    __slots__ = ('parent', 'depth', 'score', 'text_offsets', 'text_buffer', 'ids')
+
+    def __init__(self, parent, depth, score, text_offsets, text_buffer, ids):
+        self.parent = parent              # array('q'): index of the parent comment, -1 for roots
+        self.depth = depth                # array('l'): 0 for roots
+        self.score = score                # array('q')
+        self.text_offsets = text_offsets  # array('q'): comment i is text_buffer[offsets[i]:offsets[i + 1]]
+        self.text_buffer = text_buffer
+        self.ids = ids                    # list: Reddit fullname of each comment, None if unknown
+
+    @classmethod
+    def from_dicts(cls, comments):
+        """ Build a store from the {'id', 'text', 'score', 'replies'} form returned by the scrapers. """
+        parent, depth, score = array('q'), array('l'), array('q')
+        text_offsets = array('q', [0])
+        texts = []
+        ids = []
+        offset = 0
+        stack = [(comment, -1, 0) for comment in reversed(comments)]
+        while stack:
+            comment, parent_index, comment_depth = stack.pop()
+            index = len(parent)
+            parent.append(parent_index)
+            depth.append(comment_depth)
+            score.append(parse_score(comment['score']))
+            texts.append(comment['text'])
+            ids.append(comment.get('id'))
+            offset += len(comment['text'])
+            text_offsets.append(offset)
+            stack.extend((reply, index, comment_depth + 1) for reply in reversed(comment['replies']))
+        return cls(parent, depth, score, text_offsets, "".join(texts), ids)
+
+    def __len__(self):
+        return len(self.parent)
+
+    def text(self, index):
+        return self.text_buffer[self.text_offsets[index]:self.text_offsets[index + 1]]
+
+    def to_dicts(self, keep=None, texts=None):
+        """
+        Rebuild the nested {'id', 'text', 'score', 'replies'} form that `format_comments` consumes
+        (scores as ints, 'id' only where known). With `keep`, only comments where `keep[i]` is
+        true and whose parent is kept are included; `texts` maps indices to replacement texts.
+        """
+        roots = []
+        nodes = {}
+        for index in range(len(self)):
+            parent_index = self.parent[index]
+            if (keep is not None and not keep[index]) or (parent_index >= 0 and parent_index not in nodes):
+                continue
+            node = {'text': texts.get(index, self.text(index)) if texts else self.text(index),
+                    'score': self.score[index], 'replies': []}
+            if self.ids[index] is not None:
+                node = {'id': self.ids[index], **node}
+            nodes[index] = node
+            (roots if parent_index < 0 else nodes[parent_index]['replies']).append(node)
+        return roots
+
+    def children(self):
+        """ (root indices, child indices of every comment), both in tree order. """
+        roots = []
+        children = [[] for _ in range(len(self))]
+        for index in range(len(self)):
+            parent_index = self.parent[index]
+            (roots if parent_index < 0 else children[parent_index]).append(index)
+        return roots, children
+
+    def _levels(self, np):
+        """ Indices of the comments at each depth from 1 down, as NumPy arrays, plus the parent column. """
+        parent = np.frombuffer(self.parent, dtype=np.int64)
+        depth = np.frombuffer(self.depth, dtype=np.dtype(f"i{self.depth.itemsize}"))
+        order = np.argsort(depth, kind="stable")
+        bounds = np.searchsorted(depth[order], np.arange(1, int(depth.max(initial=0)) + 2))
+        return [order[start:end] for start, end in zip(bounds[:-1], bounds[1:])], parent
+
+    def subtree_sizes(self):
+        """ List of the number of comments in each comment's subtree, itself included. """
+        np = get_numpy()
+        if np is not None:
+            sizes = np.ones(len(self), dtype=np.int64)
+            levels, parent = self._levels(np)
+            # Push sizes up one level at a time, deepest level first
+            for at_level in reversed(levels):
+                np.add.at(sizes, parent[at_level], sizes[at_level])
+            return sizes.tolist()
+        sizes = [1] * len(self)
+        for index in range(len(self) - 1, -1, -1):
+            if self.parent[index] >= 0:
+                sizes[self.parent[index]] += sizes[index]
+        return sizes
+
+    def top_k(self, k):
+        """ Indices of the `k` highest scored comments, best first. """
+        k = min(k, len(self))
+        if k <= 0:
+            return []
+        np = get_numpy()
+        if np is not None:
+            scores = np.frombuffer(self.score, dtype=np.int64)
+            candidates = np.argpartition(-scores, k - 1)[:k]
+            return candidates[np.argsort(-scores[candidates], kind="stable")].tolist()
+        return heapq.nlargest(k, range(len(self)), key=self.score.__getitem__)
+
+    def select(self, keep):
+        """
+        New store with only the comments where `keep[i]` is true. A comment whose parent is
+        dropped is dropped too, so the result is always a well-formed tree.
+        """
+        np = get_numpy()
+        if np is not None:
+            return self._select_vectorized(np, keep)
+        remap = {}
+        parent, depth, score = array('q'), array('l'), array('q')
+        text_offsets = array('q', [0])
+        texts = []
+        ids = []
+        offset = 0
+        for index in range(len(self)):
+            parent_index = self.parent[index]
+            if not keep[index] or (parent_index >= 0 and parent_index not in remap):
+                continue
+            remap[index] = len(parent)
+            parent.append(remap[parent_index] if parent_index >= 0 else -1)
+            depth.append(self.depth[index])
+            score.append(self.score[index])
+            text = self.text(index)
+            texts.append(text)
+            ids.append(self.ids[index])
+            offset += len(text)
+            text_offsets.append(offset)
+        return CommentStore(parent, depth, score, text_offsets, "".join(texts), ids)
+
+    def _select_vectorized(self, np, keep):
+        kept = np.array(keep, dtype=bool)
+        levels, parent = self._levels(np)
+        # Parents are settled a level before their replies, so drops cascade down the tree
+        for at_level in levels:
+            kept[at_level] &= kept[parent[at_level]]
+        indices = np.flatnonzero(kept)
+        remap = np.cumsum(kept) - 1
+        parents = parent[indices]
+        parents = np.where(parents >= 0, remap[parents], -1)
+        offsets = np.frombuffer(self.text_offsets, dtype=np.int64)
+        starts, ends = offsets[indices], offsets[indices + 1]
+        text_offsets = np.concatenate(([0], np.cumsum(ends - starts)))
+        # Kept comments mostly come in contiguous runs (whole subtrees); each run is one slice
+        run_starts = np.flatnonzero(np.diff(indices, prepend=-2) != 1)
+        run_ends = np.append(run_starts[1:], len(indices))[:len(run_starts)] - 1
+        text_buffer = "".join(
+            self.text_buffer[start:end]
+            for start, end in zip(starts[run_starts].tolist(), ends[run_ends].tolist())
+        )
+        depth = np.frombuffer(self.depth, dtype=np.dtype(f"i{self.depth.itemsize}"))
+        score = np.frombuffer(self.score, dtype=np.int64)
+        return CommentStore(
+            _to_array('q', parents), _to_array('l', depth[indices]), _to_array('q', score[indices]),
+            _to_array('q', text_offsets), text_buffer, [self.ids[index] for index in indices.tolist()],
+        )
+
+    def filter_depth(self, max_depth):
+        """ New store without replies nested deeper than `max_depth` (roots are depth 0). """
+        np = get_numpy()
+        if np is not None:
+            depth = np.frombuffer(self.depth, dtype=np.dtype(f"i{self.depth.itemsize}"))
+            return self.select(depth <= max_depth)
+        return self.select([d <= max_depth for d in self.depth])
+
+    def nbytes(self):
+        arrays = (self.parent, self.depth, self.score, self.text_offsets)
+        ids = sum(len(comment_id) for comment_id in self.ids if comment_id)
+        return sum(a.itemsize * len(a) for a in arrays) + len(self.text_buffer.encode("utf-8")) + ids
@@ -0,0 +1,136 @@
+"""
+Google Custom Search with concurrent pagination.
+
+The CSE API returns at most 10 results per request and never more than 100 per query. All
+pages needed for `num` results are requested at once. Links are yielded in rank order as
+soon as every earlier page has arrived, so scraping can start on the first page while later
+ones are still in flight. An empty page ends the search and cancels any later page
+that has not started. Links are normalized and deduplicated across pages. `site:` terms in
+the query also filter the results. Running out of quota ends the search early with the
+results found so far instead of retrying.
+"""
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+CSE_URL = "https://www.googleapis.com/customsearch/v1"
+PAGE_SIZE = 10
+MAX_RESULTS = 100
+
+# Statuses the API uses for exhausted quota; retrying them only burns more of it
+QUOTA_STATUSES = {403, 429}
+# 5xx are still retried by the fetcher, 429 is handled here
+PAGE_RETRY_STATUSES = {500, 502, 503, 504}
+
+REDDIT_HOSTS = {"reddit.com", "www.reddit.com", "old.reddit.com", "new.reddit.com", "np.reddit.com", "m.reddit.com"}
+TRACKING_PARAMS = re.compile(r"^(utm_\w+|ref|ref_source|share_id|rdt|context)$")
+
+
+class SearchQuotaExceeded(Exception):
+    pass
+
+
+def normalize_url(url):
+    """
+    Canonical form of a result link: lower-case scheme and host, no fragment or tracking
+    parameters. Reddit mirrors (old., m., np.) map to https://www.reddit.com with a trailing slash.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = parts.netloc.lower()
+    path = parts.path or "/"
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not TRACKING_PARAMS.match(k)])
+    if host in REDDIT_HOSTS:
+        scheme, host, query = "https", "www.reddit.com", ""
+        if not path.endswith("/"):
+            path += "/"
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def site_filters(query):
+    """ The `site:` terms of a query as (host, path prefix) pairs, e.g. site:reddit.com/r/wine. """
+    filters = []
+    for term in re.findall(r"(?:^|\s)site:(\S+)", query, re.IGNORECASE):
+        host, _, path = re.sub(r"^https?://", "", term.lower()).partition("/")
+        filters.append((host, "/" + path if path else "/"))
+    return filters
+
+
+def matches_site(url, filters):
+    parts = urlsplit(url)
+    host = parts.netloc.lower()
+    return any((host == site or host.endswith("." + site)) and parts.path.startswith(path) for site, path in filters)
+
+
+def fetch_page(get, search_url, params):
+    response = get(search_url, params=params, retry_statuses=PAGE_RETRY_STATUSES)
+    if response.status_code in QUOTA_STATUSES:
+        try:
+            message = response.json()["error"]["message"]
+        except (ValueError, KeyError, TypeError):
+            message = response.text[:200]
+        raise SearchQuotaExceeded(f"{response.status_code}: {message}")
+    response.raise_for_status()  # Check for HTTP errors
+    return response.json().get('items', [])
+
+
+def iter_search_links(get, query, api_key, cse_id, num=10, search_url=CSE_URL, workers=4, stats=None):
+    """
+    Yield up to `num` unique, normalized result links for `query` in rank order.
+    Args:
+    - get (callable): Performs a GET request, e.g. `Fetcher.get`.
+    - workers (int): Pages fetched at the same time.
+    - stats (dict): Optional; filled with the number of page requests and whether quota ran out.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(requests=0, quota_exceeded=False)
+    if num > MAX_RESULTS:
+        print(f"Custom Search returns at most {MAX_RESULTS} results per query, not {num}")
+        num = MAX_RESULTS
+    filters = site_filters(query)
+    page_sizes = {start: min(PAGE_SIZE, num - start + 1) for start in range(1, num + 1, PAGE_SIZE)}
+    if not page_sizes:
+        return
+    seen = set()
+    ready = {}
+    last_start = max(page_sizes)
+    with ThreadPoolExecutor(max_workers=min(workers, len(page_sizes))) as pool:
+        futures = {
+            pool.submit(fetch_page, get, search_url, {'q': query, 'key': api_key, 'cx': cse_id, 'start': start, 'num': size}): start
+            for start, size in page_sizes.items()
+        }
+        stats['requests'] = len(futures)
+        try:
+            next_start = 1
+            pending = set(futures)
+            while pending and next_start <= last_start:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start = futures[future]
+                    if future.cancelled():
+                        continue
+                    try:
+                        items = future.result()
+                    except SearchQuotaExceeded as e:
+                        print(f"Search quota exhausted, keeping the results found so far: {e}")
+                        stats['quota_exceeded'] = True
+                        items = []
+                    ready[start] = items
+                    # Short pages are common mid-list; only an empty page marks the end of the results
+                    if not items and start < last_start:
+                        last_start = start
+                        for other, other_start in futures.items():
+                            if other_start > start and other.cancel():
+                                stats['requests'] -= 1
+                # Release pages in rank order as soon as all earlier ones are in
+                while next_start in ready and next_start <= last_start:
+                    for item in ready.pop(next_start):
+                        link = normalize_url(item['link'])
+                        if link in seen or (filters and not matches_site(link, filters)):
+                            continue
+                        seen.add(link)
+                        yield link
+                    next_start += PAGE_SIZE
+        finally:
+            for future in futures:
+                future.cancel()
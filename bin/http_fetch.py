@@ -0,0 +1,218 @@
+"""
+Shared HTTP fetch layer.
+
+One keep-alive connection pool for every request the scraper makes, with timeouts, retries
+with jittered exponential backoff on connection errors, 429 and 5xx (honouring
+Retry-After), and a minimum delay between requests to the same host. Fetched and parsed
+documents are memoized per URL, and concurrent requests for the same URL share one fetch.
+Inside `memo_scope()` (one query in batch or service mode) documents are memoized for that
+block only, so a long-running process does not keep serving the first copy it fetched.
+With a profiler every request is recorded as a "fetch" span. requests itself is only
+imported when the first request is made.
+"""
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar, copy_context
+from functools import partial
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# (fetcher, memo) of the innermost memo_scope(), if any
+_memo_scope = ContextVar('memo_scope', default=None)
+
+
+def bind_context(fn):
+    """ `fn` run in a copy of the caller's context, so pool workers use the caller's memo scope. """
+    return partial(copy_context().run, fn)
+
+
+class Memo:
+    """ Thread-safe LRU memo where concurrent requests for the same key share one computation. """
+
+    def __init__(self, size=64):
+        self.size = size
+        self._entries = OrderedDict()
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    return self._entries[key]
+            value = compute()
+            with self._lock:
+                self._entries[key] = value
+                if len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+                self._key_locks.pop(key, None)
+        return value
+
+
+class DomainThrottle:
+    """ Enforce a minimum (jittered) delay between requests to the same domain, shared across worker threads. """
+
+    def __init__(self, min_delay=0.5, jitter=0.5):
+        self.min_delay = min_delay
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self._next_allowed = {}
+
+    def wait(self, url):
+        domain = urlparse(url).netloc.lower()
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_allowed.get(domain, now))
+            # Reserve the slot before sleeping so other workers queue up behind us
+            self._next_allowed[domain] = slot + self.min_delay + random.uniform(0, self.jitter)
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def retry_after_seconds(response):
+    """ Parse a Retry-After header given either in seconds or as an HTTP date. """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Fetcher:
+    def __init__(self, headers=None, timeout=(5, 30), max_retries=4, backoff_base=0.5, backoff_max=30.0,
+                 host_delay=0.0, pool_size=16, memo_size=64, profiler=None):
+        self.headers = headers or {}
+        self.pool_size = pool_size
+        self._session = None
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.throttle = DomainThrottle(min_delay=host_delay, jitter=host_delay / 2) if host_delay > 0 else None
+        self.memo_size = memo_size
+        self.profiler = profiler
+        self._memo = Memo(memo_size)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    session.headers.update(self.headers)
+                    self._session = session
+        return self._session
+
+    def _backoff(self, attempt):
+        # Full jitter exponential backoff
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def request(self, method, url, retry_statuses=RETRY_STATUSES, **kwargs):
+        """ Like `session.request`, with the default timeout, host throttling and retries. """
+        import requests
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.max_retries + 1):
+            if self.throttle is not None:
+                self.throttle.wait(url)
+            span = self.profiler.span('fetch', host=urlparse(url).netloc, retry=attempt > 0) if self.profiler is not None else nullcontext({})
+            try:
+                with span as attrs:
+                    response = self.session.request(method, url, **kwargs)
+                    attrs['status'] = str(response.status_code)
+                    attrs['bytes'] = len(response.content)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                print(f"Request to {url} failed ({e}), retrying in {delay:.1f}s")
+            else:
+                if response.status_code not in retry_statuses or attempt == self.max_retries:
+                    return response
+                retry_after = retry_after_seconds(response)
+                delay = min(retry_after, self.backoff_max) if retry_after is not None else self._backoff(attempt)
+                print(f"{url} returned {response.status_code}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    @contextmanager
+    def memo_scope(self):
+        """
+        Memoize into a fresh memo for the duration of the block, and in pool workers whose
+        tasks are wrapped with `bind_context`. The process-wide memo is left untouched.
+        """
+        token = _memo_scope.set((self, Memo(self.memo_size)))
+        try:
+            yield
+        finally:
+            _memo_scope.reset(token)
+
+    def memoize(self, key, compute):
+        """
+        Return the memoized value for `key`, computing it at most once even when several
+        threads ask for it at the same time. Failures are not memoized.
+        """
+        scope = _memo_scope.get()
+        memo = scope[1] if scope is not None and scope[0] is self else self._memo
+        return memo.get_or_compute(key, compute)
+
+    def share(self, key, compute):
+        """
+        Run `compute` once for every thread that asks for `key` while it is running, without
+        keeping the value afterwards (unlike memoize, for results that go stale). If it fails,
+        the threads that were waiting each compute their own.
+        """
+        with self._lock:
+            call = self._in_flight.get(key)
+            owner = call is None
+            if owner:
+                call = self._in_flight[key] = {'done': threading.Event()}
+        if not owner:
+            call['done'].wait()
+            return call['value'] if 'value' in call else compute()
+        try:
+            call['value'] = compute()
+            return call['value']
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            call['done'].set()
+
+    def fetch_text(self, url, params=None):
+        def fetch():
+            response = self.get(url, params=params)
+            response.raise_for_status()  # Check for HTTP errors
+            return response.text
+        return self.memoize(('text', url, repr(params)), fetch)
+
+    def fetch_json(self, url, params=None):
+        def fetch():
+            response = self.get(url, params=params)
+            response.raise_for_status()  # Check for HTTP errors
+            return response.json()
+        return self.memoize(('json', url, repr(params)), fetch)
@@ -0,0 +1,198 @@
+"""
+Map-reduce analysis for result sets that do not fit in a single context window.
+
+Each thread (or token-bounded chunk of a long thread) is summarized into a partial ranking
+concurrently; the partial rankings are then merged into the final scored list, in several
+rounds if they do not fit in one request either.
+"""
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from http_fetch import retry_after_seconds
+
+
+@lru_cache(maxsize=None)
+def retryable_errors():
+    import anthropic  # Only needed once a request is made
+    # InternalServerError covers every 5xx, including 529 "overloaded"
+    return (anthropic.RateLimitError, anthropic.APIConnectionError, anthropic.InternalServerError)
+
+THREAD_MARKER = re.compile(r"^\s*Reddit thread \d+:\s*$", re.MULTILINE)
+
+MAP_PROMPT = """
+    You will analyze one part of a larger set of Reddit comments related to the following query:
+    QUERY (google search): {search_query}
+    Identify the query-related elements mentioned in these comments (e.g., specific items, brands, products) and, for each one, record:
+        - **Mentions**: How often it is referenced in these comments.
+        - **Upvotes**: The total upvotes of the comments mentioning it.
+        - **Sentiment**: The overall tone around it, from -1 (negative) to 1 (positive).
+
+    ### Output Format:
+    One line per element, most important first, and nothing else:
+    <element> | <mentions> | <upvotes> | <sentiment>
+
+    Here are the comments:
+
+    {comments}
+    """
+
+REDUCE_PROMPT = """
+    You will merge partial analyses of Reddit comments related to the following query:
+    QUERY (google search): {search_query}
+    Each partial analysis below lists elements as "<element> | <mentions> | <upvotes> | <sentiment>" for one part of the comments.
+    Treat differently worded references to the same element as one element and add up its mentions and upvotes.
+
+    {instructions}
+
+    Here are the partial analyses:
+
+    {partials}
+    """
+
+INTERMEDIATE_REDUCE_INSTRUCTIONS = """### Output Format:
+    One line per merged element, most important first, and nothing else:
+    <element> | <mentions> | <upvotes> | <sentiment>"""
+
+FINAL_REDUCE_INSTRUCTIONS = """Then **rank the elements** based on frequency of mentions, upvotes and sentiment, assigning each a score from 0 to 1, where:
+        - **1** indicates that the element is highly regarded and frequently mentioned with positive sentiment and support.
+        - **0** indicates that the element is less important or receives little support.
+
+    ### Output Format:
+    **Rankings**:
+        - Provide a ranked list of the elements along with a score (0-1) for each.
+        - Include all elements that are relevant to the query and are mentioned more than 2 times in total.
+        - No explanation is needed for each ranked element in your response."""
+
+
+def split_prompt_threads(prompt):
+    """ Recover the query and the individual formatted threads from an analysis prompt (e.g. a cached one). """
+    query_match = re.search(r"QUERY \(google search\): (.*)", prompt)
+    search_query = query_match.group(1).strip() if query_match else None
+    threads_section = prompt.split("Here is the set of reddit threads:", 1)[-1]
+    starts = [match.start() for match in THREAD_MARKER.finditer(threads_section)]
+    threads = [threads_section[start:end].strip() for start, end in zip(starts, starts[1:] + [len(threads_section)])]
+    return search_query, [thread for thread in threads if thread]
+
+
+def chunk_text(text, max_tokens, count_tokens):
+    """ Split text on line boundaries into chunks of at most roughly `max_tokens` tokens. """
+    chunks, current, current_tokens = [], [], 0
+    for line in text.splitlines(keepends=True):
+        line_tokens = count_tokens(line)
+        if line_tokens > max_tokens:
+            # A single huge comment: cut it by characters in proportion to its size
+            step = max(1, int(len(line) * max_tokens / line_tokens))
+            pieces = [line[i:i + step] for i in range(0, len(line), step)]
+        else:
+            pieces = [line]
+        for piece in pieces:
+            piece_tokens = line_tokens if piece is line else count_tokens(piece)
+            if current and current_tokens + piece_tokens > max_tokens:
+                chunks.append("".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def retry_delay(error, attempt, base_delay, max_delay):
+    response = getattr(error, "response", None)
+    retry_after = retry_after_seconds(response) if response is not None else None
+    if retry_after is not None:
+        return min(retry_after, max_delay)
+    # Full jitter exponential backoff
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def call_with_retries(fn, max_retries=5, base_delay=1.0, max_delay=60.0):
+    """ Call `fn`, retrying rate limits, overloads, 5xx and connection errors with backoff. """
+    retryable = retryable_errors()
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except retryable as e:
+            if attempt == max_retries:
+                raise
+            delay = retry_delay(e, attempt, base_delay, max_delay)
+            print(f"{type(e).__name__}, retrying in {delay:.1f}s ({attempt + 1}/{max_retries})")
+            time.sleep(delay)
+
+
+def complete(client, prompt, model, max_tokens, max_retries):
+    # Retries are handled by call_with_retries so the SDK's own retries don't multiply them
+    no_retry_client = client.with_options(max_retries=0)
+    message = call_with_retries(
+        lambda: no_retry_client.messages.create(
+            model=model,
+            max_tokens=max_tokens,
+            temperature=0.0,
+            messages=[{"role": "user", "content": prompt}],
+        ),
+        max_retries=max_retries,
+    )
+    return message.content[0].text
+
+
+def map_reduce_analysis(client, search_query, threads, count_tokens, model, chunk_tokens=50000,
+                        reduce_tokens=100000, concurrency=4, max_retries=5, max_tokens=2000, finalize=None):
+    """
+    Rank query-related elements across threads that together exceed one context window.
+    Args:
+    - client: An anthropic.Anthropic client.
+    - search_query (str): The original query.
+    - threads (list): Formatted thread strings.
+    - count_tokens (callable): text -> token count.
+    - chunk_tokens (int): Max tokens of thread text per map request.
+    - reduce_tokens (int): Max tokens of partial rankings per reduce request.
+    - concurrency (int): Max requests in flight.
+    - finalize (callable): Optional final_prompt -> text, e.g. to stream the last step; defaults to a plain request.
+    Returns:
+    - str: The final ranking, in the same format as the single-request analysis.
+    """
+    chunks = [chunk for thread in threads for chunk in chunk_text(thread, chunk_tokens, count_tokens)]
+    print(f"Map-reduce: {len(threads)} threads in {len(chunks)} chunks")
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        partials = list(executor.map(
+            lambda chunk: complete(
+                client, MAP_PROMPT.format(search_query=search_query, comments=chunk), model, max_tokens, max_retries
+            ),
+            chunks,
+        ))
+
+        # Merge partial rankings in groups that fit a request until one group is left
+        while True:
+            groups, current, current_tokens = [], [], 0
+            for partial in partials:
+                partial_tokens = count_tokens(partial)
+                if current and current_tokens + partial_tokens > reduce_tokens:
+                    groups.append(current)
+                    current, current_tokens = [], 0
+                current.append(partial)
+                current_tokens += partial_tokens
+            groups.append(current)
+            if len(groups) == 1:
+                break
+            print(f"Map-reduce: merging {len(partials)} partial rankings in {len(groups)} groups")
+            partials = list(executor.map(
+                lambda group: complete(client, REDUCE_PROMPT.format(
+                    search_query=search_query,
+                    instructions=INTERMEDIATE_REDUCE_INSTRUCTIONS,
+                    partials="\n\n".join(group),
+                ), model, max_tokens, max_retries),
+                groups,
+            ))
+
+    final_prompt = REDUCE_PROMPT.format(
+        search_query=search_query,
+        instructions=FINAL_REDUCE_INSTRUCTIONS,
+        partials="\n\n".join(groups[0]),
+    )
+    if finalize is not None:
+        return finalize(final_prompt)
+    return complete(client, final_prompt, model, max_tokens, max_retries)
@@ -0,0 +1,78 @@
+"""
+Targeted extraction of a Reddit post's title and body from its page HTML.
+
+Only two nodes of a (large) shreddit page matter for the relevance check: the
+`shreddit-title` tag and the `<id>-post-rtjson-content` div. With lxml installed the page
+is parsed by libxml2 and both nodes are picked with XPath. Without it BeautifulSoup is run
+with a SoupStrainer, so only those two subtrees are ever built into Python objects. The
+full BeautifulSoup parse is kept as "soup" for comparison (see bench/bench_parse.py).
+Both parsers are imported on first use.
+"""
+from functools import lru_cache
+from importlib.util import find_spec
+
+# lxml is pinned in requirements.txt; without it the strained html.parser path is used
+HAVE_LXML = find_spec("lxml") is not None
+
+BODY_ID_SUFFIX = "-post-rtjson-content"
+
+# Parser for pages that still need a full soup; lxml's builder is several times faster
+SOUP_PARSER = "lxml" if HAVE_LXML else "html.parser"
+DEFAULT_PARSER = "lxml" if HAVE_LXML else "strainer"
+
+_TITLE_XPATH = "//shreddit-title[1]/@title"
+_BODY_XPATH = f"//div[contains(@id, '{BODY_ID_SUFFIX}')]"
+
+
+def _is_post_node(name, attrs):
+    if name == "shreddit-title":
+        return True
+    return name == "div" and (attrs.get("id") or "").endswith(BODY_ID_SUFFIX)
+
+
+@lru_cache(maxsize=None)
+def post_strainer():
+    from bs4 import SoupStrainer
+    return SoupStrainer(_is_post_node)
+
+
+def _parse_lxml(html):
+    import lxml.html
+    try:
+        root = lxml.html.fromstring(html)
+    except ValueError:  # str input with an XML encoding declaration
+        root = lxml.html.fromstring(html.encode("utf-8"))
+    titles = root.xpath(_TITLE_XPATH)
+    title = str(titles[0]) if titles else None
+    body = None
+    for div in root.xpath(_BODY_XPATH):
+        if div.get("id", "").endswith(BODY_ID_SUFFIX):
+            body = "\n".join(p.text_content() for p in div.iter("p"))
+            break
+    return title, body
+
+
+def _parse_soup(soup):
+    title_tag = soup.find("shreddit-title")
+    title = title_tag.get("title") if title_tag else None
+    body_tag = soup.find("div", id=lambda x: x and x.endswith(BODY_ID_SUFFIX))
+    body = "\n".join(p.get_text() for p in body_tag.find_all("p")) if body_tag else None
+    return title, body
+
+
+def parse_post_title_and_body(html, parser=None):
+    """
+    Extract (title, body) from a post page; either is None when its node is missing.
+    `parser` is "lxml", "strainer" or "soup" (full html.parser tree), default the fastest available.
+    """
+    parser = parser or DEFAULT_PARSER
+    if parser == "lxml":
+        if not HAVE_LXML:
+            raise ValueError("The lxml parser needs the lxml package")
+        return _parse_lxml(html)
+    from bs4 import BeautifulSoup
+    if parser == "strainer":
+        return _parse_soup(BeautifulSoup(html, "html.parser", parse_only=post_strainer()))
+    if parser == "soup":
+        return _parse_soup(BeautifulSoup(html, "html.parser"))
+    raise ValueError(f"Unknown post parser: {parser}")
@@ -0,0 +1,143 @@
+"""
+Timing spans for the scrape-to-LLM pipeline.
+
+Every stage (search, page fetch, parse, relevance call, driver startup, comment expansion
+and extraction, formatting, token counting, analysis call) runs inside `profiler.span(...)`.
+Each span records its duration and thread, plus whatever the stage adds to it (bytes,
+comment counts, token usage). A run's spans and per-stage totals are written as one JSON
+report (see --profile_report); under --serve only the latest spans are kept, while the
+totals still cover all of them. cProfile or pyinstrument can be wrapped around the run as
+well; both only sample the main thread, so worker pools show up in the spans only.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+
+class Profiler:
+    def __init__(self, max_spans=None):
+        """ With `max_spans` only the latest spans are kept for the report; stage totals still count every span. """
+        self.started_at = datetime.now().isoformat()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.spans = deque(maxlen=max_spans)
+        self._stages = {}
+
+    def limit_spans(self, max_spans):
+        """ Keep only the latest `max_spans` spans from now on, e.g. for a long-running server. """
+        with self._lock:
+            self.spans = deque(self.spans, maxlen=max_spans)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """ Time the block as a `name` span; the yielded dict can be filled with more attributes. """
+        start = time.perf_counter()
+        try:
+            yield attrs
+        except Exception as e:
+            attrs['error'] = type(e).__name__
+            raise
+        finally:
+            end = time.perf_counter()
+            record = {
+                'name': name,
+                'start': start - self._start,
+                'seconds': end - start,
+                'thread': threading.current_thread().name,
+                **attrs,
+            }
+            with self._lock:
+                self.spans.append(record)
+                self._add_to_stage(record)
+
+    def _add_to_stage(self, span):
+        stage = self._stages.setdefault(span['name'], {'count': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+        stage['count'] += 1
+        stage['errors'] += 'error' in span
+        stage['total_seconds'] += span['seconds']
+        stage['max_seconds'] = max(stage['max_seconds'], span['seconds'])
+        for key, value in span.items():
+            if key not in ('start', 'seconds') and isinstance(value, (int, float)) and not isinstance(value, bool):
+                stage[key] = stage.get(key, 0) + value
+
+    def stages(self):
+        """ Per-span-name count, timing and the sums of every numeric attribute, over all spans recorded. """
+        with self._lock:
+            stages = {name: dict(stage) for name, stage in self._stages.items()}
+        for stage in stages.values():
+            stage['mean_seconds'] = stage['total_seconds'] / stage['count']
+        return stages
+
+    def report(self, **context):
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            'started_at': self.started_at,
+            'wall_seconds': time.perf_counter() - self._start,
+            **context,
+            'stages': self.stages(),
+            'spans': spans,
+        }
+
+    def write_report(self, path, **context):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.report(**context), f, indent=2, default=str)
+
+    def print_summary(self):
+        stages = sorted(self.stages().items(), key=lambda item: item[1]['total_seconds'], reverse=True)
+        for name, stage in stages:
+            print(f"{name:<20} {stage['count']:5d} spans  {stage['total_seconds']:8.2f}s total  "
+                  f"{stage['mean_seconds'] * 1000:8.1f}ms mean  {stage['max_seconds'] * 1000:8.1f}ms max")
+
+
+@contextmanager
+def profile_code(kind, output_path=None, top=25):
+    """
+    Run the block under cProfile or pyinstrument and print the hottest functions.
+    With `output_path` the raw profile is saved too (pstats file, or pyinstrument HTML).
+    """
+    if kind is None:
+        yield
+        return
+    if kind == "cprofile":
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            if output_path:
+                profile.dump_stats(output_path)
+            out = io.StringIO()
+            pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(top)
+            print(out.getvalue())
+        return
+    if kind == "pyinstrument":
+        try:
+            from pyinstrument import Profiler as SamplingProfiler
+        except ImportError:
+            raise ValueError("The pyinstrument profiler needs the pyinstrument package")
+        profile = SamplingProfiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            if output_path:
+                with open(output_path, 'w') as f:
+                    f.write(profile.output_html())
+            print(profile.output_text())
+        return
+    raise ValueError(f"Unknown profiler: {kind}")
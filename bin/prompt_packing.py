@@ -0,0 +1,196 @@
+"""
+Fit scraped threads into a token budget for the final analysis prompt.
+
+Comments from all threads compete for the budget. The most valuable comments (upvoted,
+near the top of their thread, from threads ranked higher in the search results) are kept
+first, a reply is only considered once its parent is in, and whatever does not fit is
+dropped together with its replies. Very long comments are truncated. Each thread is ranked
+and selected as a CommentStore, so comment values are computed over its score and depth
+arrays in one pass.
+"""
+import heapq
+import itertools
+import math
+
+from comment_store import CommentStore, get_numpy
+
+
+def comment_value(score, depth, thread_rank):
+    # Upvotes count with diminishing returns; downvoted comments sink below unscored ones
+    if score >= 0:
+        base = 1.0 + math.log1p(score)
+    else:
+        base = 1.0 / (1.0 - score)
+    return base / (1.0 + 0.5 * depth) / (1.0 + 0.1 * thread_rank)
+
+
+def comment_values(store, thread_rank):
+    """ `comment_value` of every comment in `store`; formatted depths start at 1 for roots. """
+    np = get_numpy()
+    if np is None:
+        return [comment_value(score, depth + 1, thread_rank) for score, depth in zip(store.score, store.depth)]
+    scores = np.frombuffer(store.score, dtype=np.int64).astype(np.float64)
+    depths = np.frombuffer(store.depth, dtype=np.dtype(f"i{store.depth.itemsize}")) + 1
+    base = np.where(scores >= 0, 1.0 + np.log1p(np.maximum(scores, 0)), 1.0 / (1.0 - np.minimum(scores, 0)))
+    return (base / (1.0 + 0.5 * depths) / (1.0 + 0.1 * thread_rank)).tolist()
+
+
+def comment_tokens(text, score, depth, count_tokens):
+    indent = "    " * depth
+    return count_tokens(f"{indent}- Comment: {text}\n{indent}  Score: {score}\n")
+
+
+def truncate_text(text, max_tokens, count_tokens):
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    # Character cut proportional to the token overshoot, good enough for a hard cap
+    return text[:int(len(text) * max_tokens / tokens)].rstrip() + " [...]"
+
+
+def count_comments(comments):
+    # Iterative, so reply chains deeper than the recursion limit can be counted
+    total = 0
+    stack = [comments]
+    while stack:
+        siblings = stack.pop()
+        total += len(siblings)
+        stack.extend(comment['replies'] for comment in siblings)
+    return total
+
+
+def pack_threads(threads, budget, count_tokens, format_thread, max_comment_tokens=400, count_tokens_batch=None,
+                 assemble=None, estimate_tokens=None):
+    """
+    Greedily fill `budget` tokens with the highest value comments across all threads.
+    Args:
+    - threads (list): (thread_idx, comments) pairs, most relevant thread first.
+    - budget (int): Tokens available for the assembled text.
+    - count_tokens (callable): text -> token count, used for whole threads and the assembled text.
+    - format_thread (callable): (thread_idx, comments) -> formatted thread string.
+    - max_comment_tokens (int): Longer comments are truncated to roughly this many tokens.
+    - count_tokens_batch (callable): Optional [text, ...] -> [count, ...] used to size whole threads in parallel.
+    - assemble (callable): Optional packed threads -> the final text that has to fit, e.g. the whole
+      prompt; defaults to the formatted threads joined together.
+    - estimate_tokens (callable): Optional cheap local text -> token count for single comments and
+      truncations, when `count_tokens` is expensive (e.g. an API call). It is scaled to agree
+      with `count_tokens` on the whole threads.
+    Returns:
+    - tuple: (packed threads as (thread_idx, comments) pairs, {thread_idx: {'tokens', 'comments_kept', 'comments_total'}}).
+    """
+    if assemble is None:
+        def assemble(packed):
+            return "".join(format_thread(thread_idx, comments) for thread_idx, comments in packed)
+    report = {
+        thread_idx: {'tokens': 0, 'comments_kept': 0, 'comments_total': count_comments(comments)}
+        for thread_idx, comments in threads
+    }
+    base_tokens = count_tokens(assemble([]))
+    thread_texts = [format_thread(thread_idx, comments) for thread_idx, comments in threads]
+    counts = count_tokens_batch(thread_texts) if count_tokens_batch else [count_tokens(text) for text in thread_texts]
+    full_tokens = {thread_idx: tokens for (thread_idx, _), tokens in zip(threads, counts)}
+    piece_tokens = count_tokens
+    if estimate_tokens is not None:
+        estimated = sum(estimate_tokens(text) for text in thread_texts)
+        ratio = sum(counts) / estimated if estimated else 1.0
+
+        def piece_tokens(text):
+            return math.ceil(estimate_tokens(text) * ratio)
+    if base_tokens + sum(full_tokens.values()) <= budget and count_tokens(assemble(threads)) <= budget:
+        for thread_idx, stats in report.items():
+            stats['tokens'] = full_tokens[thread_idx]
+            stats['comments_kept'] = stats['comments_total']
+        return list(threads), report
+
+    used = base_tokens
+    stores = [CommentStore.from_dicts(comments) for _, comments in threads]
+    thread_idxs = [thread_idx for thread_idx, _ in threads]
+    # Per thread: kept flags, truncated texts, cost of each kept comment and its number of kept replies
+    keep = [[False] * len(store) for store in stores]
+    texts = [{} for _ in stores]
+    costs = [{} for _ in stores]
+    kept_replies = [[0] * len(store) for store in stores]
+    replies_header_tokens = {}
+    sequence = itertools.count()
+    heap = []
+
+    def replies_header_cost(parent_depth):
+        # The "Replies:" line sits at the parent's indent
+        if parent_depth not in replies_header_tokens:
+            replies_header_tokens[parent_depth] = piece_tokens(f"{'    ' * parent_depth}  Replies:\n")
+        return replies_header_tokens[parent_depth]
+
+    tree_children = []
+    values = []
+    for thread_rank, store in enumerate(stores):
+        roots, children = store.children()
+        tree_children.append(children)
+        values.append(comment_values(store, thread_rank))
+        for index in roots:
+            heapq.heappush(heap, (-values[thread_rank][index], next(sequence), thread_rank, index))
+
+    while heap:
+        _, _, thread_rank, index = heapq.heappop(heap)
+        store, thread_idx = stores[thread_rank], thread_idxs[thread_rank]
+        depth = store.depth[index] + 1
+        text = truncate_text(store.text(index), max_comment_tokens, piece_tokens)
+        cost = comment_tokens(text, store.score[index], depth, piece_tokens)
+        parent_index = store.parent[index]
+        if parent_index >= 0 and kept_replies[thread_rank][parent_index] == 0:
+            cost += replies_header_cost(depth - 1)
+        if report[thread_idx]['comments_kept'] == 0:
+            cost += count_tokens(format_thread(thread_idx, []))
+        if used + cost > budget:
+            continue  # Dropped along with all of its replies
+        used += cost
+        report[thread_idx]['tokens'] += cost
+        report[thread_idx]['comments_kept'] += 1
+        keep[thread_rank][index] = True
+        costs[thread_rank][index] = cost
+        if text != store.text(index):
+            texts[thread_rank][index] = text
+        if parent_index >= 0:
+            kept_replies[thread_rank][parent_index] += 1
+        for child in tree_children[thread_rank][index]:
+            heapq.heappush(heap, (-values[thread_rank][child], next(sequence), thread_rank, child))
+
+    def packed_threads():
+        # Kept comments come back in their original order, since stores are in tree order
+        packed = []
+        for thread_rank, store in enumerate(stores):
+            if report[thread_idxs[thread_rank]]['comments_kept']:
+                packed.append((thread_idxs[thread_rank], store.to_dicts(keep=keep[thread_rank], texts=texts[thread_rank])))
+        return packed
+
+    # Pieces were counted one at a time, but tokens can merge across their boundaries, so the
+    # assembled text is checked and the lowest value leaf comments are dropped until it fits
+    leaves = [
+        (values[thread_rank][index], next(sequence), thread_rank, index)
+        for thread_rank in range(len(stores))
+        for index in costs[thread_rank]
+        if kept_replies[thread_rank][index] == 0
+    ]
+    heapq.heapify(leaves)
+    packed = packed_threads()
+    total = count_tokens(assemble(packed))
+    while total > budget and leaves:
+        freed = 0
+        while leaves and freed < total - budget:
+            _, _, thread_rank, index = heapq.heappop(leaves)
+            thread_idx = thread_idxs[thread_rank]
+            cost = costs[thread_rank].pop(index)
+            keep[thread_rank][index] = False
+            freed += cost
+            report[thread_idx]['tokens'] -= cost
+            report[thread_idx]['comments_kept'] -= 1
+            parent_index = stores[thread_rank].parent[index]
+            if parent_index >= 0:
+                kept_replies[thread_rank][parent_index] -= 1
+                if kept_replies[thread_rank][parent_index] == 0:
+                    heapq.heappush(leaves, (values[thread_rank][parent_index], next(sequence), thread_rank, parent_index))
+        packed = packed_threads()
+        total = count_tokens(assemble(packed))
+    for stats in report.values():
+        if stats['comments_kept'] == 0:
+            stats['tokens'] = 0
+    return packed, report
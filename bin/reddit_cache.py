@@ -0,0 +1,141 @@
+"""
+Persistent on-disk cache for search results, fetched posts, comment trees and relevance
+verdicts.
+
+Entries live in a single SQLite file, grouped by namespace. Each namespace has its own TTL,
+and the least recently used entries are evicted once the stored values exceed `max_bytes`.
+A namespace can also keep entries past their TTL for reads that accept stale values, such as
+the comment trees that --refresh scrapes against.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "search_reddit", "cache.sqlite3")
+
+# Seconds before an entry is considered stale, per namespace
+DEFAULT_TTLS = {
+    'search': 24 * 3600,
+    'post': 7 * 24 * 3600,
+    'comments': 24 * 3600,
+    'verdict': 30 * 24 * 3600,
+}
+
+# Seconds an entry is kept in total, for reads that accept stale values (see `get`'s max_age);
+# other namespaces drop entries at their TTL
+DEFAULT_RETENTION = {
+    # Stale comment trees are still the base trees for --refresh
+    'comments': 30 * 24 * 3600,
+}
+
+
+def hash_text(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def make_key(*parts):
+    """ Content-address a cache entry by the JSON form of its key parts. """
+    return hash_text(json.dumps(parts, sort_keys=True, default=str))
+
+
+class PersistentCache:
+    """
+    Thread-safe SQLite-backed key/value cache with per-namespace TTLs, size-based LRU
+    eviction and hit/miss counters. Values must be JSON serializable.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=512 * 1024 * 1024, ttls=None, retention=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.retention = dict(DEFAULT_RETENTION)
+        self.retention.update(retention or {})
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def get(self, namespace, key, default=None, max_age=None):
+        """ The stored value, or `default` if it is older than `max_age` seconds (the namespace's TTL by default). """
+        now = time.time()
+        ttl = self.ttls.get(namespace, float("inf"))
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, size, created FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row is not None and now - row[2] > max(ttl, self.retention.get(namespace, 0)):
+                self._conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+                self._total_bytes -= row[1]
+                row = None
+            elif row is not None and now - row[2] > (ttl if max_age is None else max_age):
+                # Stale for this read, but retained for reads that accept older values
+                row = None
+            if row is None:
+                self.misses[namespace] += 1
+                return default
+            self._conn.execute(
+                "UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?", (now, namespace, key)
+            )
+            self.hits[namespace] += 1
+        return json.loads(row[0])
+
+    def set(self, namespace, key, value):
+        data = json.dumps(value).encode("utf-8")
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT size FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, data, len(data), now, now),
+            )
+            self._total_bytes += len(data) - (old[0] if old else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Drop least recently used entries until the cache is back under 90% of its size budget
+        target = self.max_bytes * 0.9
+        rows = self._conn.execute("SELECT namespace, key, size FROM entries ORDER BY accessed ASC")
+        victims = []
+        for namespace, key, size in rows:
+            if self._total_bytes <= target:
+                break
+            victims.append((namespace, key))
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?", victims)
+
+    def stats(self):
+        namespaces = sorted(set(self.hits) | set(self.misses))
+        return {
+            namespace: {'hits': self.hits[namespace], 'misses': self.misses[namespace]}
+            for namespace in namespaces
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
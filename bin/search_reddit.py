@@ -1,56 +1,304 @@
-import requests
-from bs4 import BeautifulSoup
+# selenium, bs4, rich, requests and anthropic are imported where they are first needed, so
+# `--help`, a `--cache_prompt` replay or importing the scraping helpers stays fast
 import time
 import sys
 import os
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import NoSuchElementException, ElementClickInterceptedException, TimeoutException
 from time import sleep
-from selenium.webdriver.chrome.service import Service
 import random
-from rich.console import Console
-from rich.markdown import Markdown
-import tiktoken 
-import anthropic
 import argparse
+import threading
+import itertools
+import queue
+from collections import Counter
+from contextlib import contextmanager, ExitStack
+from functools import partial
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
 from datetime import datetime
-
-
-client = anthropic.Anthropic(
-    # defaults to os.environ.get("ANTHROPIC_API_KEY")
-    api_key=os.environ["ANTHROPIC_API_KEY"],
-)
+from reddit_cache import DEFAULT_CACHE_PATH, PersistentCache, hash_text, make_key
+from prompt_packing import count_comments, pack_threads
+from token_counting import RunningTokenCount, TokenCounter
+from http_fetch import DomainThrottle, Fetcher, bind_context
+from cse_search import CSE_URL, iter_search_links, normalize_url
+from post_parsing import DEFAULT_PARSER, SOUP_PARSER, parse_post_title_and_body
+from profiling import PROFILERS, Profiler, profile_code
+from map_reduce_analysis import map_reduce_analysis, split_prompt_threads
+from thread_snapshots import compare_to_snapshot, copy_comment, count_fetched, format_refresh_counts, index_snapshot
+
+
+# Built on first use by get_client(), so importing this module needs no credentials
+client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global client
+    with _client_lock:
+        if client is None:
+            import anthropic
+            # Raises if ANTHROPIC_API_KEY is not set
+            client = anthropic.Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
+    return client
 
 GOOGLE_SEARCH_CSE_ID = os.getenv('GOOGLE_SEARCH_CSE_ID')
 GOOGLE_SEARCH_API_KEY = os.getenv('GOOGLE_SEARCH_API_KEY')
+# Overridable so the search can be pointed at a stub server
+GOOGLE_SEARCH_URL = os.getenv('GOOGLE_SEARCH_URL', CSE_URL)
+
+ANALYSIS_MODEL = "claude-3-5-sonnet-20240620"
+
+# Candidate URLs containing this are treated as Reddit threads (the offline benchmarks point it at their fixture server)
+REDDIT_URL_MARKER = "reddit.com"
+
+REDDIT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
+}
+
+# Timing spans for every stage of the run (see --profile_report)
+profiler = Profiler()
+
+# Pooled HTTP session shared by every page, JSON and search request (see --http_host_delay)
+http = Fetcher(headers=REDDIT_HEADERS, profiler=profiler)
+
+# Persistent cache shared by all stages; None disables caching (see --no_cache)
+cache = None
+
+# new/refreshed/reused/rescored comment totals over every thread refreshed by this process (see --refresh)
+refresh_counts = Counter()
+_refresh_lock = threading.Lock()
+
+# Shared token counter; the encoder is loaded on first use (see --token_counter)
+token_counter = TokenCounter()
+
+_MISSING = object()
+
+
+def cached_call(namespace, key_parts, compute, should_cache=lambda value: value is not None):
+    """ Return the cached value for `key_parts` in `namespace`, computing and storing it on a miss. """
+    if cache is None:
+        return compute()
+    key = make_key(*key_parts)
+    value = cache.get(namespace, key, _MISSING)
+    if value is not _MISSING:
+        return value
+    value = compute()
+    if should_cache(value):
+        cache.set(namespace, key, value)
+    return value
 
 
 # USAGE: python3.9 ~/Downloads/search_reddit.py --search_query "best things to do in the bay area site:reddit.com" --num_links_from_search 15
 
 
+DEFAULT_RESULTS_PATH = os.path.join(os.path.expanduser("~"), "Downloads", "search_reddit_results.jsonl")
+# Spans kept for --profile_report under --serve; stage totals still cover every query
+MAX_SERVE_SPANS = 10000
+
+
+def positive_int(value):
+    """ argparse type for worker counts and batch sizes, where 0 would hang or fail later. """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Run the Reddit to LLM scraper.")
     parser.add_argument("--search_query", type=str, help="Search query string for Google search.")
     parser.add_argument("--url_list", nargs='+', help="List of URLs to scrape.")
-    parser.add_argument("--num_links_from_search", type=int, default=10, help="Number of Google search results to return (default is 10).")
+    parser.add_argument("--num_links_from_search", type=int, default=10, help="Number of Google search results to return (default is 10, at most 100).")
+    parser.add_argument("--search_workers", type=positive_int, default=4, help="Search result pages fetched at the same time (default is 4).")
+    parser.add_argument("--cache_prompt", type=str, help="Path to a previously cached prompt file to analyze instead of scraping.")
+    parser.add_argument("--concurrent", action="store_true", help="Fetch, check and scrape threads concurrently instead of one at a time.")
+    parser.add_argument("--fetch_workers", type=positive_int, default=4, help="Max concurrent post fetches in concurrent mode (default is 4).")
+    parser.add_argument("--check_workers", type=positive_int, default=4, help="Max concurrent relevance checks in concurrent mode (default is 4).")
+    parser.add_argument("--scrape_workers", type=positive_int, default=2, help="Max concurrent comment scrapes in concurrent mode (default is 2).")
+    parser.add_argument("--driver_pool_size", type=int, default=0, help="Number of long-lived browsers to reuse across threads; 0 launches a fresh browser per thread (default is 0).")
+    parser.add_argument("--headless", action="store_true", help="Run Chrome browsers in headless mode, pooled (see --driver_pool_size) or not.")
+    parser.add_argument("--extraction_mode", choices=["script", "html", "element"], default="script", help="How comments are read from the browser: one script call, one page source snapshot, or per-element WebDriver calls (default is script).")
+    parser.add_argument("--scrape_backend", choices=["selenium", "json"], default="selenium", help="Scrape comments with a browser, or over plain HTTP from the thread's .json form with the browser as fallback (default is selenium).")
+    parser.add_argument("--relevance_model", type=str, default=RELEVANCE_MODEL, help=f"Model used to check whether a thread addresses the query (default is {RELEVANCE_MODEL}).")
+    parser.add_argument("--relevance_batch_size", type=positive_int, default=8, help="Threads classified per relevance request (default is 8).")
+    parser.add_argument("--token_budget", type=int, default=180000, help="Token budget for the analysis prompt; lower-value comments are dropped to fit, 0 disables packing (default is 180000).")
+    parser.add_argument("--analysis_mode", choices=["single", "map_reduce"], default="single", help="Analyze everything in one request, or summarize threads/chunks concurrently and merge the partial rankings (default is single).")
+    parser.add_argument("--map_concurrency", type=positive_int, default=4, help="Max concurrent requests in map_reduce mode (default is 4).")
+    parser.add_argument("--map_chunk_tokens", type=positive_int, default=50000, help="Max thread tokens per map request in map_reduce mode (default is 50000).")
+    parser.add_argument("--max_retries", type=int, default=5, help="Retries with backoff for rate-limited or failed requests in map_reduce mode (default is 5).")
+    parser.add_argument("--stream", action="store_true", help="Stream the final ranking to the terminal as it is generated and record latency metrics.")
+    parser.add_argument("--latency_log", type=str, default=DEFAULT_LATENCY_LOG, help=f"JSONL file that --stream appends time-to-first-token and throughput metrics to (default is {DEFAULT_LATENCY_LOG}).")
+    parser.add_argument("--token_counter", choices=["tiktoken", "anthropic"], default="tiktoken", help="Count tokens with the local cl100k approximation or with Anthropic's token counting (default is tiktoken).")
+    parser.add_argument("--http_host_delay", type=float, default=0.0, help="Minimum seconds between HTTP requests to the same host (default is 0).")
+    parser.add_argument("--http_timeout", type=float, default=30.0, help="Read timeout in seconds for HTTP requests (default is 30).")
+    parser.add_argument("--cache_path", type=str, default=DEFAULT_CACHE_PATH, help=f"SQLite file for cached search results, posts, comments and verdicts (default is {DEFAULT_CACHE_PATH}).")
+    parser.add_argument("--cache_max_mb", type=int, default=512, help="Size budget of the cache in MB; least recently used entries are evicted beyond it (default is 512).")
+    parser.add_argument("--cache_ttls", nargs='+', default=[], metavar="NAMESPACE=SECONDS", help="Override cache TTLs, e.g. search=3600 comments=600 (namespaces: search, post, comments, verdict).")
+    parser.add_argument("--no_cache", action="store_true", help="Disable the persistent cache.")
+    parser.add_argument("--refresh", action="store_true", help="Re-scrape threads against their cached comment trees (even stale ones) instead of returning them; the json backend then only fetches comments that are new.")
+    parser.add_argument("--profile_report", type=str, help="Write per-stage timing spans and totals for the run to this JSON file.")
+    parser.add_argument("--profiler", choices=PROFILERS, help="Also run the whole pipeline under cProfile or pyinstrument (main thread only).")
+    parser.add_argument("--profiler_output", type=str, help="Save the raw --profiler output here (pstats file, or HTML for pyinstrument).")
+    parser.add_argument("--domain_delay", type=float, default=0.5, help="Minimum seconds between requests to the same domain in concurrent mode (default is 0.5).")
+    parser.add_argument("--query_file", type=str, help="Run every query in this file ('-' for stdin): one search query per line, or a JSON object with search_query, url_list and num_links_from_search.")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="Keep running as a local HTTP service on this port; POST a JSON query to /query.")
+    parser.add_argument("--query_workers", type=positive_int, default=2, help="Queries run at the same time in --query_file and --serve modes (default is 2).")
+    parser.add_argument("--output_jsonl", type=str, default=DEFAULT_RESULTS_PATH, help=f"JSONL file that --query_file and --serve append one result per query to (default is {DEFAULT_RESULTS_PATH}).")
     return parser.parse_args()
 
 
-def setup_driver():
+def setup_driver(headless=False):
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
     # Configure options for Chrome
     options = Options()
-    #options.add_argument('--headless')  # Runs Chrome in headless mode.
+    if headless:
+        options.add_argument('--headless')  # Runs Chrome in headless mode.
     options.add_argument('--no-sandbox')
     options.add_argument('--disable-dev-shm-usage')
-    driver = webdriver.Chrome(options=options)
+    with profiler.span('driver_startup', headless=headless):
+        driver = webdriver.Chrome(options=options)
     return driver
 
 
+class DriverPool:
+    """
+    A fixed-size pool of long-lived Chrome drivers built on `setup_driver`.
+    Drivers are started lazily, leased with `with pool.lease() as driver:`, reset (cookies,
+    storage, extra windows) when they are returned, and replaced if they stop responding.
+    At most `size` browsers are ever alive at once, which caps total browser memory.
+    """
+
+    def __init__(self, size=1, headless=True):
+        self.size = max(1, size)
+        self.headless = headless
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._drivers = set()
+        self._closed = False
+
+    def _new_driver(self):
+        driver = setup_driver(headless=self.headless)
+        with self._lock:
+            self._drivers.add(driver)
+        return driver
+
+    def _discard(self, driver):
+        with self._lock:
+            self._drivers.discard(driver)
+        try:
+            driver.quit()
+        except Exception as e:
+            print(f"Error shutting down browser: {e}")
+
+    @staticmethod
+    def _is_healthy(driver):
+        from selenium.common.exceptions import WebDriverException
+        try:
+            driver.execute_script("return 1;")
+            return True
+        except WebDriverException:
+            return False
+
+    @staticmethod
+    def _reset(driver):
+        from selenium.common.exceptions import WebDriverException
+        # Close any popups so only the original window is left
+        handles = driver.window_handles
+        for handle in handles[1:]:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(handles[0])
+        try:
+            driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+        except WebDriverException:
+            pass  # Storage is not accessible on some pages (e.g. about:blank)
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        driver.get("about:blank")
+
+    def _acquire(self):
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                return self._new_driver()
+            if self._is_healthy(driver):
+                return driver
+            print("Restarting unresponsive browser.")
+            self._discard(driver)
+
+    def _release(self, driver, healthy):
+        from selenium.common.exceptions import WebDriverException
+        if healthy and not self._closed:
+            try:
+                self._reset(driver)
+            except WebDriverException as e:
+                print(f"Failed to reset browser, restarting it: {e}")
+                healthy = False
+        if healthy and not self._closed:
+            self._idle.put(driver)
+        else:
+            self._discard(driver)
+
+    @contextmanager
+    def lease(self):
+        from selenium.common.exceptions import WebDriverException
+        if self._closed:
+            raise RuntimeError("DriverPool is closed")
+        self._slots.acquire()
+        try:
+            driver = self._acquire()
+        except Exception:
+            self._slots.release()
+            raise
+        healthy = True
+        try:
+            yield driver
+        except WebDriverException:
+            healthy = self._is_healthy(driver)
+            raise
+        finally:
+            self._release(driver, healthy)
+            self._slots.release()
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(driver)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def fetch_page_html(url):
+    return cached_call('post', ('html', url), lambda: http.fetch_text(url))
+
+
+def fetch_page_soup(url):
+    """ Fetch and parse a page once; every extractor asking for the same URL shares the result. """
+    def parse():
+        from bs4 import BeautifulSoup
+        html = fetch_page_html(url)
+        with profiler.span('parse', parser=SOUP_PARSER, bytes=len(html)):
+            return BeautifulSoup(html, SOUP_PARSER)
+    return http.memoize(('soup', url), parse)
+
+
+def parse_post_page(url):
+    html = fetch_page_html(url)
+    with profiler.span('parse', parser=DEFAULT_PARSER, bytes=len(html)):
+        return parse_post_title_and_body(html)
+
+
 def get_reddit_post_title_and_body(url):
     """
     This function extracts the title and body of a Reddit post from a given URL.
@@ -59,26 +307,13 @@ def get_reddit_post_title_and_body(url):
     Returns:
     - tuple: A tuple containing the title and the body of the Reddit post (title, body).
     """
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-    }
+    import requests
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()  # Check for HTTP errors
-        # Parse the page with BeautifulSoup
-        soup = BeautifulSoup(response.text, 'html.parser')
-        # Extract the title from the 'shreddit-title' tag
-        title_tag = soup.find("shreddit-title")
-        if title_tag:
-            title = title_tag.get("title")
-        else:
+        # Only the title and post-content nodes are parsed out of the page
+        title, body = parse_post_page(url)
+        if title is None:
             title = "Title not found"
-        # Extract the body from the div with the post content
-        body_tag = soup.find("div", id=lambda x: x and x.endswith("-post-rtjson-content"))
-        if body_tag:
-            # Extract the paragraphs from the body
-            body = "\n".join(p.get_text() for p in body_tag.find_all("p"))
-        else:
+        if body is None:
             body = "Body not found"
         return title, body
     except requests.exceptions.RequestException as e:
@@ -99,18 +334,10 @@ def get_reddit_post_title(url):
     Returns:
     - str: The title of the Reddit post.
     """
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-    }
+    import requests
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()  # Check for HTTP errors
-        # Parse the page with BeautifulSoup
-        soup = BeautifulSoup(response.text, 'html.parser')
-        # Extract the title from the 'shreddit-title' tag
-        title_tag = soup.find("shreddit-title")
-        if title_tag:
-            title = title_tag.get("title")
+        title, _ = parse_post_page(url)
+        if title is not None:
             return title
         else:
             print("Title tag not found in the page.")
@@ -123,10 +350,7 @@ def get_reddit_post_title(url):
         return None
 
 def scrape_top_level_comments(url):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
-    response = requests.get(url, headers=headers)
-    soup = BeautifulSoup(response.text, 'html.parser')
+    soup = fetch_page_soup(url)
     comments = []
     # Find the div that contains all comments
     for comment_area in soup.find_all("div", class_="_2M2wOqmeoPVvcSsJ6Po9-V"):
@@ -141,57 +365,49 @@ def scrape_top_level_comments(url):
 
 def google_search_old(query, api_key, cse_id, **kwargs):
     """ Perform a Google search using the Custom Search JSON API. """
-    search_url = "https://www.googleapis.com/customsearch/v1"
+    search_url = GOOGLE_SEARCH_URL
     params = {
         'q': query,
         'key': api_key,
         'cx': cse_id
     }
     params.update(kwargs)
-    response = requests.get(search_url, params=params)
+    response = http.get(search_url, params=params)
     return response.json()
 
 
-def google_search(query, api_key, cse_id, num=10):
-    """ Perform a Google search using the Custom Search JSON API with pagination support. """
-    search_url = "https://www.googleapis.com/customsearch/v1"
-    results = []
-    start_index = 1
-    
-    # Google CSE API only allows a maximum of 10 results per request, so we need to loop if num > 10
-    while len(results) < num:
-        # Calculate how many more results we still need
-        batch_size = min(10, num - len(results))  # Fetch up to 10 at a time
-        params = {
-            'q': query,
-            'key': api_key,
-            'cx': cse_id,
-            'start': start_index,  # For pagination, this is the index of the first result to return
-            'num': batch_size
-        }
-        response = requests.get(search_url, params=params)
-        response.raise_for_status()  # Check for HTTP errors
-        data = response.json()
-        items = data.get('items', [])
-        
-        # Append new results
-        results.extend(items)
-        
-        # If no more results are available, break out of the loop
-        if not items:
-            break
-        
-        # Update the start index for the next batch (Google uses 1-based indexing)
-        start_index += batch_size
-
-    return results[:num]  # Return only the number of results requested
+def google_search(query, api_key, cse_id, num=10, workers=4):
+    """ Perform a Google search using the Custom Search JSON API; returns up to `num` unique result links. """
+    return list(iter_google_search(query, api_key, cse_id, num=num, workers=workers))
+
+
+def iter_google_search(query, api_key, cse_id, num=10, workers=4):
+    """
+    Yield result links as their pages arrive, fetching all pages concurrently (see cse_search).
+    Complete result lists are cached; a search cut short by quota is not.
+    """
+    key_parts = ('links', query, cse_id, num)
+    if cache is not None:
+        links = cache.get('search', make_key(*key_parts))
+        if links is not None:
+            yield from links
+            return
+    links, stats = [], {}
+    with profiler.span('search', num=num) as span:
+        for link in iter_search_links(http.get, query, api_key, cse_id, num=num, search_url=GOOGLE_SEARCH_URL,
+                                      workers=workers, stats=stats):
+            links.append(link)
+            yield link
+        span.update(links=len(links), requests=stats['requests'], quota_exceeded=stats['quota_exceeded'])
+    print(f"Search used {stats['requests']} Custom Search requests")
+    if cache is not None and links and not stats['quota_exceeded']:
+        cache.set('search', make_key(*key_parts), links)
 
 def extract_content(url):
     """ Extract and return text and image URLs from the specified URL. """
+    import requests
     try:
-        response = requests.get(url)
-        response.raise_for_status()  # Check for HTTP errors
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = fetch_page_soup(url)
         # Extract text
         text = ' '.join([p.text for p in soup.find_all('p')])
         # Extract image src's
@@ -202,26 +418,79 @@ def extract_content(url):
         return {'url': url, 'text': '', 'images': []}
 
 
-def click_load_more_comments(driver):
-    # Wait until the load more button is found with the exact class name
-    more_replies_buttons = WebDriverWait(driver, 10).until(
-        EC.presence_of_all_elements_located((By.CSS_SELECTOR, "button[class='text-tone-2 text-12 no-underline hover:underline px-xs py-xs flex ml-[3px] xs:ml-0 !bg-transparent !border-0']"))
-    )
-    for button in more_replies_buttons:
-        driver.execute_script("arguments[0].scrollIntoView(true);", button)
-        sleep(random.uniform(0.5, 2))  # Ensure the button is visible
-        try:
-            button.click()  # Attempt to click the button
-        except ElementClickInterceptedException:
-            # If normal click fails, use JavaScript click
-            driver.execute_script("arguments[0].click();", button)
-        sleep(random.uniform(1, 2))  # Delay to mimic human interaction and allow for load
+MORE_REPLIES_BUTTON_SELECTOR = "button[class='text-tone-2 text-12 no-underline hover:underline px-xs py-xs flex ml-[3px] xs:ml-0 !bg-transparent !border-0']"
+
+
+# Clicks every "more replies" button currently in the page in one round trip. Buttons are
+# marked so one that is still waiting for its replies to load is not clicked twice.
+CLICK_ALL_MORE_REPLIES_JS = """
+const buttons = Array.from(document.querySelectorAll(arguments[0])).filter(b => !b.dataset.expandClicked);
+buttons.forEach(b => { b.dataset.expandClicked = "1"; b.click(); });
+return buttons.length;
+"""
+
+COUNT_COMMENTS_JS = "return document.querySelectorAll('shreddit-comment').length;"
+
+# Resolves with the new comment count once it has changed, the DOM has been quiet for
+# `quietMs` and every clicked "more replies" button has been replaced by its replies, or
+# with the current count after `timeoutMs`. Clicked buttons are not clicked again, so
+# returning while some are still loading would lose their replies.
+WAIT_FOR_COMMENT_GROWTH_JS = """
+const [previous, timeoutMs, quietMs, done] = arguments;
+const count = () => document.querySelectorAll('shreddit-comment').length;
+const pending = () => document.querySelectorAll('[data-expand-clicked]').length;
+let quietTimer = null;
+const finish = () => { observer.disconnect(); clearTimeout(deadline); clearTimeout(quietTimer); done(count()); };
+const settle = () => { if (!pending()) { finish(); } };
+const observer = new MutationObserver(() => {
+    if (count() !== previous) {
+        clearTimeout(quietTimer);
+        quietTimer = setTimeout(settle, quietMs);
+    }
+});
+observer.observe(document.body, {childList: true, subtree: true});
+const deadline = setTimeout(finish, timeoutMs);
+if (count() !== previous) { quietTimer = setTimeout(settle, quietMs); }
+"""
+
+
+def expand_all_comments(driver, max_rounds=50, settle_timeout=5.0, quiet_period=0.3):
+    """
+    Expand collapsed replies by clicking all visible "more replies" buttons in one batch per
+    round, then waiting for the comment count to change and for every clicked button's replies
+    to load instead of sleeping. Stops as soon as there is nothing left to click or a round
+    adds no comments.
+    Returns:
+    - dict: {'rounds', 'seconds', 'comments'} for reporting.
+    """
+    start = time.perf_counter()
+    # Pooled drivers are reused, so their script timeout is put back afterwards
+    previous_script_timeout = driver.timeouts.script
+    driver.set_script_timeout(settle_timeout + 5)
+    try:
+        comment_count = driver.execute_script(COUNT_COMMENTS_JS)
+        rounds = 0
+        while rounds < max_rounds:
+            clicked = driver.execute_script(CLICK_ALL_MORE_REPLIES_JS, MORE_REPLIES_BUTTON_SELECTOR)
+            if not clicked:
+                break
+            rounds += 1
+            new_count = driver.execute_async_script(
+                WAIT_FOR_COMMENT_GROWTH_JS, comment_count, int(settle_timeout * 1000), int(quiet_period * 1000)
+            )
+            if new_count <= comment_count:
+                break
+            comment_count = new_count
+    finally:
+        driver.set_script_timeout(previous_script_timeout)
+    return {'rounds': rounds, 'seconds': time.perf_counter() - start, 'comments': comment_count}
 
 
 def extract_comments(driver, element):
+    from selenium.common.exceptions import NoSuchElementException
+    from selenium.webdriver.common.by import By
     #sleep(random.uniform(0.5, 2))
     # Extract the main comment text
-    # click_load_more_comments(driver, element)
     try:
         comment_text = element.find_element(By.CSS_SELECTOR, "div[slot='comment']").text.strip()
         comment_score = element.get_attribute("score")
@@ -230,6 +499,7 @@ def extract_comments(driver, element):
         comment_text = ""
         comment_score = 0
     comment_dict = {
+        'id': element.get_attribute("thingid"),
         'text': comment_text,
         'score': comment_score,
         'replies': []
@@ -245,52 +515,395 @@ def extract_comments(driver, element):
     return comment_dict
 
 
-def scrape_reddit_comments(url):
-    sleep(random.uniform(0.5, 2))
-    driver = setup_driver()
-    driver.get(url)
+# Serializes the whole comment tree in the page in a single WebDriver round trip. A reply belongs
+# to the closest enclosing shreddit-comment, so each comment appears exactly once in the tree.
+EXTRACT_COMMENT_TREE_JS = """
+function ownedBy(el, nodes) {
+    return Array.from(nodes).filter(n => n.parentElement.closest("shreddit-comment") === el);
+}
+function extract(el) {
+    const body = ownedBy(el, el.querySelectorAll("div[slot='comment']"))[0];
+    const replies = ownedBy(el, el.querySelectorAll("shreddit-comment[slot^='children-']"));
+    return {
+        id: el.getAttribute("thingid"),
+        text: body ? body.innerText.trim() : "",
+        score: body ? el.getAttribute("score") : 0,
+        replies: replies.map(extract)
+    };
+}
+return Array.from(document.querySelectorAll("shreddit-comment[depth='0']")).map(extract);
+"""
+
+
+def extract_comments_from_html(html):
+    """
+    Build the comment tree from a single page source snapshot instead of querying the live DOM.
+    Args:
+    - html (str): The page source of a Reddit thread with its comments expanded.
+    Returns:
+    - list: Root comments as {'id', 'text', 'score', 'replies'} dicts.
+    """
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, SOUP_PARSER)
+    comment_nodes = {}
+    roots = []
+    # Document order guarantees a parent is seen before its replies
+    for element in soup.find_all("shreddit-comment"):
+        parent = element.find_parent("shreddit-comment")
+        comment_dict = {'id': element.get("thingid"), 'text': "", 'score': 0, 'replies': []}
+        comment_nodes[id(element)] = comment_dict
+        if parent is None:
+            if element.get("depth") == "0":
+                roots.append(comment_dict)
+        elif id(parent) in comment_nodes and (element.get("slot") or "").startswith("children-"):
+            comment_nodes[id(parent)]['replies'].append(comment_dict)
+    filled = set()
+    for body in soup.find_all("div", attrs={"slot": "comment"}):
+        owner = body.find_parent("shreddit-comment")
+        # Only the first comment body inside a comment belongs to it
+        if owner is None or id(owner) not in comment_nodes or id(owner) in filled:
+            continue
+        filled.add(id(owner))
+        comment_nodes[id(owner)]['text'] = body.get_text("\n", strip=True)
+        comment_nodes[id(owner)]['score'] = owner.get("score")
+    return roots
+
+
+def extract_comment_tree(driver, extraction_mode="script"):
+    """
+    Extract every root comment (and its replies) from the loaded thread.
+    extraction_mode:
+    - "element": walk the tree with per-element WebDriver calls (several round trips per comment)
+    - "script": serialize the tree in the browser with one execute_script call
+    - "html": parse one page_source snapshot in Python
+    """
+    from selenium.webdriver.common.by import By
+    with profiler.span('extract_comments', mode=extraction_mode) as span:
+        if extraction_mode == "script":
+            comments = driver.execute_script(EXTRACT_COMMENT_TREE_JS)
+        elif extraction_mode == "html":
+            html = driver.page_source
+            span['bytes'] = len(html)
+            comments = extract_comments_from_html(html)
+        else:
+            comments = []
+            root_comment_elements = driver.find_elements(By.CSS_SELECTOR, "shreddit-comment[depth='0']")
+            for root_element in root_comment_elements:
+                comments.append(extract_comments(driver, root_element))  # Start the recursive extraction
+        span['comments'] = count_comments(comments)
+    return comments
+
+
+def scrape_comments_with_driver(driver, url, extraction_mode="script"):
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+    with profiler.span('page_load'):
+        driver.get(url)
+        # Wait for the comments tree to load
+        try:
+            WebDriverWait(driver, 10).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, "shreddit-comment-tree"))
+            )
+        except TimeoutException:
+            print("Failed to load the comment tree.")
+            return []
     try:
-        while True:
-            click_load_more_comments(driver)
+        with profiler.span('expand_comments') as span:
+            expansion = expand_all_comments(driver)
+            span.update(rounds=expansion['rounds'], comments=expansion['comments'])
+        print(f"Expanded {url}: {expansion['rounds']} rounds, {expansion['seconds']:.1f}s, {expansion['comments']} comments")
     except TimeoutException:
-        print("No more 'load more comments' buttons found or timed out waiting for them.")
-    except NoSuchElementException:
-        print("All comments expanded.")
+        print("Timed out waiting for more comments to load.")
     except Exception as e:
         print("An error occurred while clicking:", e)
-    # Wait for the comments tree to load
+    return extract_comment_tree(driver, extraction_mode=extraction_mode)
+
+
+def scrape_reddit_comments(url, driver_pool=None, extraction_mode="script", headless=False):
+    """
+    Scrape the full comment tree of a Reddit thread with a browser.
+    Uses a leased browser from `driver_pool` when given, otherwise starts (and quits) a fresh
+    one, headless if `headless`.
+    """
+    sleep(random.uniform(0.5, 2))
+    if driver_pool is not None:
+        with driver_pool.lease() as driver:
+            return scrape_comments_with_driver(driver, url, extraction_mode=extraction_mode)
+    driver = setup_driver(headless=headless)
     try:
-        WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.CSS_SELECTOR, "shreddit-comment-tree"))
-        )
-    except TimeoutException:
-        print("Failed to load the comment tree.")
+        return scrape_comments_with_driver(driver, url, extraction_mode=extraction_mode)
+    finally:
         driver.quit()
-        return []
-    sleep(1)  # Ensure all comments have loaded, might need adjustment or scrolling
-    comments = []
-    root_comment_elements = driver.find_elements(By.CSS_SELECTOR, "shreddit-comment[depth='0']")
-    for root_element in root_comment_elements:
-        comments.append(extract_comments(driver, root_element))  # Start the recursive extraction
-    driver.quit()
-    return comments
+
+
+# Reddit caps the number of comment ids per morechildren request
+MORECHILDREN_BATCH_SIZE = 100
+
+
+def reddit_json_url(url, path_suffix=""):
+    """ Turn a thread (or comment permalink) URL into its `.json` form on the same host. """
+    parsed = urlparse(url)
+    path = parsed.path.rstrip('/') + path_suffix
+    return f"{parsed.scheme}://{parsed.netloc}{path}.json"
+
+
+def fetch_reddit_thread_json(url):
+    # Memoized, so the post check and the comment scrape of a thread share one request
+    return http.fetch_json(reddit_json_url(url), params={'raw_json': 1, 'limit': 500})
+
+
+def get_reddit_post_title_and_body_json(url):
+    """
+    Same as `get_reddit_post_title_and_body`, but reads the post from the thread's `.json` form.
+    Returns:
+    - tuple: (title, body), or (None, None) if the thread could not be fetched.
+    """
+    import requests
+
+    def fetch():
+        post = fetch_reddit_thread_json(url)[0]['data']['children'][0]['data']
+        return [post.get('title') or "Title not found", post.get('selftext') or "Body not found"]
+    try:
+        title, body = cached_call('post', ('json', url), fetch)
+    except (requests.exceptions.RequestException, ValueError, KeyError, IndexError) as e:
+        print(f"Error fetching the post JSON: {e}")
+        return None, None
+    return title, body
+
+
+def scrape_reddit_comments_json(url, max_more_requests=50, snapshot=None, counts=None):
+    """
+    Scrape the full comment tree of a Reddit thread over plain HTTP, without a browser.
+    The first page of comments comes from the thread's `.json` form; collapsed "load more"
+    stubs are expanded through /api/morechildren and "continue this thread" links through
+    the parent comment's permalink.
+    Args:
+    - url (str): The URL of the Reddit thread.
+    - max_more_requests (int): Upper bound on follow-up requests for collapsed comments.
+    - snapshot (list): A previous scrape of the thread. Collapsed comments (and "continue this
+      thread" branches) found in it are reused instead of fetched again.
+    - counts (Counter): Receives how many comments were 'new', 'refreshed' (fetched again),
+      'reused' from the snapshot and 'rescored'.
+    Returns:
+    - list: Root comments as {'id', 'text', 'score', 'replies'} dicts, like `scrape_reddit_comments`.
+    """
+    post_listing, comment_listing = fetch_reddit_thread_json(url)
+    link_id = post_listing['data']['children'][0]['data']['name']
+    parsed = urlparse(url)
+    base_url = f"{parsed.scheme}://{parsed.netloc}"
+    roots = []
+    comments_by_name = {}
+    more_ids = []
+    continue_parents = []
+    known = index_snapshot(snapshot) if snapshot else {}
+    counts = Counter() if counts is None else counts
+
+    def add_comment(data, parent):
+        comment_dict = {'id': data['name'], 'text': data.get('body', ""), 'score': data.get('score', 0), 'replies': []}
+        comments_by_name[data['name']] = comment_dict
+        parent.append(comment_dict)
+        count_fetched(counts, known, comment_dict)
+        return comment_dict
+
+    def reuse(comment, parent, with_replies=False):
+        comment_dict = copy_comment(comment, with_replies)
+        parent.append(comment_dict)
+        stack = [comment_dict]
+        while stack:
+            reused = stack.pop()
+            if reused['id']:
+                comments_by_name[reused['id']] = reused
+            counts['reused'] += 1
+            stack.extend(reused['replies'])
+
+    def queue_more(child_ids):
+        # Stubs list every collapsed descendant, so each known one is reused on its own,
+        # parents first; the rest (and any whose parent is not in the tree) are fetched
+        positions = {child_id: known[f"t1_{child_id}"][2] for child_id in child_ids if f"t1_{child_id}" in known}
+        for child_id in sorted(child_ids, key=lambda child_id: positions.get(child_id, len(known))):
+            name = f"t1_{child_id}"
+            if name in comments_by_name:
+                continue
+            if child_id in positions:
+                comment, parent_name, _ = known[name]
+                if parent_name is None:
+                    reuse(comment, roots)
+                    continue
+                if parent_name in comments_by_name:
+                    reuse(comment, comments_by_name[parent_name]['replies'])
+                    continue
+            more_ids.append(child_id)
+
+    def walk(children, parent):
+        for child in children:
+            data = child['data']
+            if child['kind'] == 't1':
+                comment_dict = add_comment(data, parent)
+                if data.get('replies'):
+                    walk(data['replies']['data']['children'], comment_dict['replies'])
+            elif child['kind'] == 'more':
+                parent_name = data.get('parent_id', '')
+                if data.get('children'):
+                    queue_more(data['children'])
+                elif parent_name in known and known[parent_name][0]['replies'] and parent_name in comments_by_name:
+                    # Known branch: new replies this deep are only picked up by a full scrape
+                    for reply in known[parent_name][0]['replies']:
+                        if reply.get('id') and reply['id'] not in comments_by_name:
+                            reuse(reply, comments_by_name[parent_name]['replies'], with_replies=True)
+                elif parent_name.startswith('t1_'):
+                    # "Continue this thread" stub: only reachable via the parent's permalink
+                    continue_parents.append(parent_name)
+
+    walk(comment_listing['data']['children'], roots)
+
+    requests_made = 0
+    while (more_ids or continue_parents) and requests_made < max_more_requests:
+        requests_made += 1
+        if more_ids:
+            batch, more_ids = more_ids[:MORECHILDREN_BATCH_SIZE], more_ids[MORECHILDREN_BATCH_SIZE:]
+            response = http.get(f"{base_url}/api/morechildren.json", params={
+                'api_type': 'json',
+                'link_id': link_id,
+                'children': ",".join(batch),
+                'raw_json': 1,
+            })
+            response.raise_for_status()
+            # Things come back flat, parents before their replies
+            for thing in response.json()['json']['data']['things']:
+                data = thing['data']
+                if thing['kind'] == 't1':
+                    parent = comments_by_name.get(data.get('parent_id'))
+                    add_comment(data, parent['replies'] if parent else roots)
+                elif thing['kind'] == 'more':
+                    walk([thing], roots)
+        else:
+            parent_name = continue_parents.pop(0)
+            parent = comments_by_name.get(parent_name)
+            response = http.get(reddit_json_url(url, "/" + parent_name[3:]), params={'raw_json': 1})
+            response.raise_for_status()
+            # The permalink listing starts with the parent comment itself
+            for child in response.json()[1]['data']['children']:
+                if child['kind'] == 't1' and child['data']['name'] == parent_name and child['data'].get('replies'):
+                    walk(child['data']['replies']['data']['children'], parent['replies'] if parent else roots)
+    if more_ids or continue_parents:
+        print(f"Stopped expanding collapsed comments after {requests_made} requests.")
+    return roots
+
+
+def fetch_post_title_and_body(url, scrape_backend="selenium"):
+    if scrape_backend == "json":
+        post_title, post_body = get_reddit_post_title_and_body_json(url)
+        if post_title is not None:
+            return post_title, post_body
+    return get_reddit_post_title_and_body(url)
+
+
+def scrape_thread_comments(url, scrape_backend="selenium", driver_pool=None, extraction_mode="script",
+                           refresh=False, headless=False):
+    """
+    Scrape a thread's comment tree with the chosen backend. The "json" backend falls back
+    to the browser if the thread's JSON can not be fetched or parsed.
+    With `refresh` the cached tree is not returned as is: the thread is scraped again against
+    it as the snapshot, even once it is past its TTL, and the "json" backend then only fetches
+    collapsed comments that are not in it.
+    """
+    import requests
+    cache_key = make_key(url)
+
+    def scrape(snapshot=None):
+        counts = Counter()
+        with profiler.span('scrape_comments', backend=scrape_backend, refresh=snapshot is not None) as span:
+            comments = None
+            if scrape_backend == "json":
+                try:
+                    comments = scrape_reddit_comments_json(url, snapshot=snapshot, counts=counts)
+                except (requests.exceptions.RequestException, ValueError, KeyError, IndexError) as e:
+                    print(f"JSON scrape of {url} failed ({e}), falling back to the browser.")
+                    span['fallback'] = True
+            if comments is None:
+                comments = scrape_reddit_comments(url, driver_pool=driver_pool, extraction_mode=extraction_mode, headless=headless)
+                counts = compare_to_snapshot(index_snapshot(snapshot or []), comments)
+            span['comments'] = count_comments(comments)
+            if snapshot is not None:
+                span.update(counts)
+        if snapshot is not None:
+            print(f"Refreshed {url}: {format_refresh_counts(counts)}")
+            with _refresh_lock:
+                refresh_counts.update(counts)
+        return comments
+
+    def refresh_scrape():
+        # The cached tree is the snapshot, so each thread is stored once
+        snapshot = cache.get('comments', cache_key, [], max_age=float("inf")) if cache is not None else []
+        comments = scrape(snapshot)
+        if comments and cache is not None:
+            cache.set('comments', cache_key, comments)
+        return comments
+
+    if refresh:
+        compute = refresh_scrape
+    else:
+        # Empty trees are usually failed scrapes, don't keep them around
+        compute = partial(cached_call, 'comments', (url,), scrape, should_cache=bool)
+    # Queries running at the same time in batch or service mode share one scrape of a thread they both found
+    return http.share(('comments', url, scrape_backend, extraction_mode, refresh), compute)
+
+
+def write_formatted_comments(comments, write, depth=1, include_replies=True):
+    """
+    Emit the formatted comment tree through `write` (e.g. `list.append` or a file's `write`)
+    in one pass and without recursion, so the work is linear in the size of the output and
+    reply depth is not bounded by the recursion limit.
+    """
+    # Each entry is an iterator over one level of siblings and that level's depth
+    stack = [(iter(comments), depth)]
+    while stack:
+        siblings, depth = stack[-1]
+        indent = "    " * depth  # Create an indentation based on the depth of the comment
+        for comment in siblings:
+            if comment['replies'] and include_replies:
+                write(f"{indent}- Comment: {comment['text']}\n{indent}  Score: {comment['score']}\n{indent}  Replies:\n")
+                # Descend into the replies; this level resumes from its iterator afterwards
+                stack.append((iter(comment['replies']), depth + 1))
+                break
+            write(f"{indent}- Comment: {comment['text']}\n{indent}  Score: {comment['score']}\n")
+        else:
+            stack.pop()
 
 
 def format_comments(comments, depth=1, include_replies=True):
-    output = ""
-    indent = "    " * depth  # Create an indentation based on the depth of the comment
-    for comment in comments:
-        output += f"{indent}- Comment: {comment['text']}\n"
-        output += f"{indent}  Score: {comment['score']}\n"
-        if comment['replies'] and include_replies:
-            output += f"{indent}  Replies:\n"
-            output += format_comments(comment['replies'], depth + 1)  # Recursively format replies
-    return output
+    output = []
+    with profiler.span('format') as span:
+        write_formatted_comments(comments, output.append, depth=depth, include_replies=include_replies)
+        text = "".join(output)
+        span['bytes'] = len(text)
+    return text
 
 
 def calculate_token_count(text):
-    encoding = tiktoken.get_encoding("cl100k_base")
-    return len(encoding.encode(text, disallowed_special=()))
+    with profiler.span('count_tokens', chars=len(text)) as span:
+        span['tokens'] = token_counter.count(text)
+    return span['tokens']
+
+
+def estimate_token_count(text):
+    # Local and not profiled: it runs once per comment while packing and chunking
+    return token_counter.estimate(text)
+
+
+def calculate_token_counts(texts):
+    with profiler.span('count_tokens', chars=sum(len(text) for text in texts), texts=len(texts)) as span:
+        counts = token_counter.count_batch(texts)
+        span['tokens'] = sum(counts)
+    return counts
+
+
+def record_usage(span, usage):
+    """ Copy an API response's token usage onto a profiling span. """
+    for field in ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens'):
+        span[field] = getattr(usage, field, None) or 0
 
 
 
@@ -348,8 +961,11 @@ It wasn't perfect, its clear the writers didn't plan out everything and there is
 """
 
 
-def check_if_thread_addresses_query(query, thread_title, thread_body):
-    prompt = f"""
+RELEVANCE_MODEL = "claude-3-5-sonnet-20240620"
+
+# Static few-shot instructions shared by every relevance request. Sent as a cached system
+# block so repeated checks only pay for it once per cache lifetime.
+RELEVANCE_FEW_SHOT_PROMPT = f"""
     "Given the following query (e.g. google search) assess the following title and body of a reddit thread. 
     Respond with YES if the thread seems directly pertinent to the question and NO otherwise. Below are some examples.  The value in the RESPONSE field is your expected response in these cases.
     EXAMPLE 1: 
@@ -389,8 +1005,28 @@ def check_if_thread_addresses_query(query, thread_title, thread_body):
     RESPONSE: NO
 
     This is too specific to just talking about Lost.  The user seems to be looking for a thread that gets opinions from everyone on their favorite tv show of all time, not just if Lost is their favorite.
+    """
 
 
+def request_relevance(prompt, model, max_tokens):
+    with profiler.span('relevance_llm', model=model) as span:
+        message = get_client().beta.prompt_caching.messages.create(
+            model=model,
+            max_tokens=max_tokens,
+            temperature=0.0,
+            system=[
+                {"type": "text", "text": RELEVANCE_FEW_SHOT_PROMPT, "cache_control": {"type": "ephemeral"}}
+            ],
+            messages=[
+                {"role": "user", "content": prompt}
+            ]
+        )
+        record_usage(span, message.usage)
+    return message.content[0].text
+
+
+def classify_thread(query, thread_title, thread_body, model=RELEVANCE_MODEL):
+    prompt = f"""
     Carefully review these examples and their learnings, then carefully read the following information for a new reddit thread and query and respond either YES or NO.  
     It is absolutely critical that you include no other words in your response other than either "YES" or "NO".
 
@@ -398,65 +1034,275 @@ def check_if_thread_addresses_query(query, thread_title, thread_body):
     TITLE: {thread_title}
     BODY: {thread_body}
     """
-    #claude-3-haiku-20240307
-    message = client.messages.create(
-        model="claude-3-5-sonnet-20240620",
-        max_tokens=1000,
-        temperature=0.0,
-        messages=[
-            {"role": "user", "content": prompt}
-        ]
+    return request_relevance(prompt, model, max_tokens=5)
+
+
+def parse_batch_verdicts(text, num_threads):
+    """ Parse "<n>: YES|NO" lines into a list of verdicts; raises ValueError unless every thread got one. """
+    verdicts = {}
+    for match in re.finditer(r"^\W*(\d+)\W+(YES|NO)\b", text, re.MULTILINE | re.IGNORECASE):
+        verdicts[int(match.group(1))] = match.group(2).upper()
+    if sorted(verdicts) != list(range(1, num_threads + 1)):
+        raise ValueError(f"Expected verdicts for threads 1-{num_threads}, got: {text!r}")
+    return [verdicts[number] for number in range(1, num_threads + 1)]
+
+
+def classify_thread_batch(query, posts, model=RELEVANCE_MODEL):
+    threads = "".join(
+        f"""
+    THREAD {number}:
+    TITLE: {thread_title}
+    BODY: {thread_body}
+    """
+        for number, (thread_title, thread_body) in enumerate(posts, start=1)
     )
-    return message.content[0].text
+    prompt = f"""
+    Carefully review these examples and their learnings, then carefully read the following {len(posts)} reddit threads and decide YES or NO for each one against the query.
+    Respond with exactly one line per thread in the form "<thread number>: YES" or "<thread number>: NO", in order, and no other words.
 
-def reddit_to_llm(search_query=None, url_list=None, num_links_from_search=10):
-    reddit_threads_list = []
-    if url_list is None:
-        url_list = []
-    
-    # Perform the search
-    if search_query is not None:
-        print(num_links_from_search)
-        results = google_search(search_query, GOOGLE_SEARCH_API_KEY, GOOGLE_SEARCH_CSE_ID, num=num_links_from_search)  # Adjust 'num' as needed
-        google_search_urls = [item['link'] for item in results]
-    else:
-        google_search_urls = []
-
-    print("google_search_urls:")
-    for url in google_search_urls:
-        print(url)
-
-    print("")
-    print("passed_url_list:")
-    for url in url_list:
-        print(url)
-    all_urls = google_search_urls + url_list
-    print("")
-    print("All urls:")
-    print(all_urls)
-    print("All reddits selected:")
-    for thread_idx, thread_url in enumerate(all_urls):
-        if "reddit.com" in thread_url:
-            post_title, post_body = get_reddit_post_title_and_body(thread_url)
-            good_thread_check = check_if_thread_addresses_query(search_query, post_title, post_body)
-            print(thread_url, good_thread_check)
-            #print(search_query, post_title, post_body)
-            if "YES" in good_thread_check:
-                print(thread_url, post_title)
-                sleep(random.uniform(1, 2))
-                # Example usage
-                #thread_url = 'https://www.reddit.com/r/wine/comments/18fn4fg/favorite_bottle_of_wine_under_20/'
-                print(thread_url)
-                comments = scrape_reddit_comments(thread_url)
-                reddit_thread = format_comments(comments)
-                reddit_thread_str = f"""
+    QUERY: {query}
+    {threads}
+    """
+    return parse_batch_verdicts(request_relevance(prompt, model, max_tokens=16 + 8 * len(posts)), len(posts))
+
+
+def verdict_key(query, thread_title, thread_body, model):
+    return (query, thread_title, hash_text(thread_body), model)
+
+
+def check_if_thread_addresses_query(query, thread_title, thread_body, model=RELEVANCE_MODEL):
+    return cached_call(
+        'verdict', verdict_key(query, thread_title, thread_body, model),
+        lambda: classify_thread(query, thread_title, thread_body, model=model),
+    )
+
+
+def classify_threads(query, posts, model=RELEVANCE_MODEL):
+    """
+    Decide which threads address the query with as few LLM calls as possible.
+    Cached verdicts are reused and the rest are classified in a single batched request. If the
+    batched answer can not be parsed, each thread is classified on its own instead.
+    Args:
+    - query (str): The search query.
+    - posts (list): (title, body) tuples.
+    Returns:
+    - list: "YES"/"NO" verdicts in the same order as `posts`.
+    """
+    verdicts = [None] * len(posts)
+    if cache is not None:
+        for i, (thread_title, thread_body) in enumerate(posts):
+            verdicts[i] = cache.get('verdict', make_key(*verdict_key(query, thread_title, thread_body, model)))
+    missing = [i for i, verdict in enumerate(verdicts) if verdict is None]
+    if len(missing) > 1:
+        try:
+            for i, verdict in zip(missing, classify_thread_batch(query, [posts[i] for i in missing], model=model)):
+                verdicts[i] = verdict
+        except ValueError as e:
+            print(f"Could not parse batched relevance verdicts, checking threads one by one: {e}")
+    for i in missing:
+        if verdicts[i] is None:
+            verdicts[i] = classify_thread(query, *posts[i], model=model)
+        if cache is not None:
+            cache.set('verdict', make_key(*verdict_key(query, *posts[i], model)), verdicts[i])
+    return verdicts
+
+
+def format_reddit_thread(thread_idx, comments):
+    reddit_thread = format_comments(comments)
+    reddit_thread_str = f"""
                 Reddit thread {thread_idx}:
 
                 {reddit_thread}
 
                 """
-                reddit_threads_list.append(reddit_thread_str)
+    return reddit_thread_str
+
+
+def scrape_threads_concurrently(search_query, urls, fetch_post, classify_posts, scrape_comments, relevance_batch_size=8,
+                                fetch_workers=4, check_workers=4, scrape_workers=2, domain_delay=0.5):
+    """
+    Run the fetch -> relevance check -> comment scrape pipeline for many threads at once.
+    Each stage runs on its own bounded worker pool, so e.g. relevance checks for later threads
+    overlap with the browser scrape of earlier ones. Fetched posts are classified in batches of
+    up to `relevance_batch_size`. Requests to the same domain are spaced out by `domain_delay` seconds.
+    Args:
+    - search_query (str): The query the threads are checked against.
+    - urls (list): Candidate thread URLs, in prompt order.
+    - fetch_post (callable): url -> (title, body).
+    - classify_posts (callable): (query, [(title, body), ...]) -> ["YES"/"NO", ...].
+    - scrape_comments (callable): url -> comment tree.
+    Returns:
+    - list: (thread_idx, comments) pairs for the accepted threads, in the same order as `urls`.
+    """
+    throttle = DomainThrottle(min_delay=domain_delay, jitter=domain_delay)
+
+    def fetch(thread_url):
+        throttle.wait(thread_url)
+        return fetch_post(thread_url)
+
+    def scrape(thread_url):
+        throttle.wait(thread_url)
+        return scrape_comments(thread_url)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=fetch_workers) as fetch_pool, \
+            ThreadPoolExecutor(max_workers=check_workers) as check_pool, \
+            ThreadPoolExecutor(max_workers=scrape_workers) as scrape_pool:
+        # future -> (stage, [(thread_idx, thread_url, post_title, post_body), ...])
+        pending = {}
+        for thread_idx, thread_url in enumerate(urls):
+            if REDDIT_URL_MARKER in thread_url:
+                pending[fetch_pool.submit(bind_context(fetch), thread_url)] = ('fetch', [(thread_idx, thread_url, None, None)])
+        fetched = []
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, items = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"An error occurred during {stage} of {[item[1] for item in items]}: {e}")
+                    continue
+                if stage == 'fetch':
+                    thread_idx, thread_url, _, _ = items[0]
+                    fetched.append((thread_idx, thread_url, *result))
+                elif stage == 'check':
+                    for (thread_idx, thread_url, post_title, _), good_thread_check in zip(items, result):
+                        print(thread_url, good_thread_check)
+                        if "YES" in good_thread_check:
+                            print(thread_url, post_title)
+                            pending[scrape_pool.submit(bind_context(scrape), thread_url)] = ('scrape', [(thread_idx, thread_url, post_title, None)])
+                else:
+                    results[items[0][0]] = result
+            # Flush full batches right away, and the remainder once no more fetches can join it
+            fetches_left = any(stage == 'fetch' for stage, _ in pending.values())
+            while len(fetched) >= relevance_batch_size or (fetched and not fetches_left):
+                batch, fetched = fetched[:relevance_batch_size], fetched[relevance_batch_size:]
+                posts = [(post_title, post_body) for _, _, post_title, post_body in batch]
+                pending[check_pool.submit(bind_context(classify_posts), search_query, posts)] = ('check', batch)
+    # Keep the same `Reddit thread {thread_idx}` order as the serial path
+    return [(thread_idx, results[thread_idx]) for thread_idx in sorted(results)]
+
+
+def reddit_to_llm(search_query=None, url_list=None, num_links_from_search=10, concurrent=False,
+                  fetch_workers=4, check_workers=4, scrape_workers=2, domain_delay=0.5,
+                  driver_pool=None, driver_pool_size=0, headless=False, extraction_mode="script",
+                  scrape_backend="selenium", relevance_model=RELEVANCE_MODEL, relevance_batch_size=8,
+                  token_budget=None, search_workers=4, refresh=False):
+    """
+    Search, filter and scrape Reddit threads for `search_query` (plus `url_list`) and build the analysis prompt.
+    With a `token_budget`, the threads are packed so the whole prompt stays within that many tokens.
+    """
+    with ExitStack() as stack:
+        if driver_pool is None and driver_pool_size > 0:
+            driver_pool = stack.enter_context(DriverPool(size=driver_pool_size, headless=headless))
+        fetch_post = partial(fetch_post_title_and_body, scrape_backend=scrape_backend)
+        classify_posts = partial(classify_threads, model=relevance_model)
+        scrape_comments = partial(scrape_thread_comments, scrape_backend=scrape_backend,
+                                  driver_pool=driver_pool, extraction_mode=extraction_mode, refresh=refresh,
+                                  headless=headless)
+        running_tokens = RunningTokenCount(token_counter)
+
+        def scrape_and_count(thread_url):
+            # Counted in the scrape workers, so the prompt size is known as soon as scraping ends
+            comments = scrape_comments(thread_url)
+            # One piece per comment, as format_comments would write it
+            pieces = []
+            write_formatted_comments(comments, pieces.append)
+            with profiler.span('count_tokens', chars=sum(len(piece) for piece in pieces), texts=len(pieces)) as span:
+                total = running_tokens.add_pieces(pieces, key=thread_url)
+                span['tokens'] = running_tokens.per_key[thread_url]
+            print(f"{thread_url}: {running_tokens.per_key[thread_url]} tokens, running total {total}")
+            return comments
+
+        reddit_threads_list = collect_reddit_threads(
+            search_query, url_list, num_links_from_search, fetch_post, classify_posts, scrape_and_count,
+            concurrent=concurrent, relevance_batch_size=relevance_batch_size,
+            fetch_workers=fetch_workers, check_workers=check_workers, scrape_workers=scrape_workers,
+            domain_delay=domain_delay, search_workers=search_workers,
+        )
+    # Local estimate for progress only; with the anthropic counter it runs below the real count
+    estimated_tokens = (estimate_token_count(build_analysis_prompt(search_query, [])) + running_tokens.total
+                        + estimate_token_count(format_reddit_thread(0, [])) * len(reddit_threads_list))
+    print(f"Estimated prompt tokens: {estimated_tokens}")
+
+    def assemble(threads):
+        return build_analysis_prompt(search_query, [format_reddit_thread(thread_idx, comments) for thread_idx, comments in threads])
+
+    if token_budget:
+        # pack_threads counts the whole assembled prompt and only trims it if that is over the budget
+        reddit_threads_list, packing_report = pack_threads(
+            reddit_threads_list, token_budget, calculate_token_count, format_reddit_thread,
+            count_tokens_batch=calculate_token_counts, assemble=assemble, estimate_tokens=estimate_token_count,
+        )
+        if any(stats['comments_kept'] < stats['comments_total'] for stats in packing_report.values()):
+            print("Tokens used per thread:")
+            for thread_idx, stats in packing_report.items():
+                print(f"  Reddit thread {thread_idx}: {stats['tokens']} tokens, {stats['comments_kept']}/{stats['comments_total']} comments")
+    return assemble(reddit_threads_list)
 
+
+def collect_reddit_threads(search_query, url_list, num_links_from_search, fetch_post, classify_posts, scrape_comments,
+                           concurrent=False, relevance_batch_size=8, fetch_workers=4, check_workers=4, scrape_workers=2, domain_delay=0.5,
+                           search_workers=4):
+    reddit_threads_list = []
+    if url_list is None:
+        url_list = []
+    # An empty batch would never fill, and the concurrent flush loop would spin on it
+    relevance_batch_size = max(1, relevance_batch_size)
+
+    def candidate_urls():
+        # Search results first, then passed urls that the search did not already return
+        seen = set()
+        if search_query is not None:
+            print(num_links_from_search)
+            for url in iter_google_search(search_query, GOOGLE_SEARCH_API_KEY, GOOGLE_SEARCH_CSE_ID,
+                                          num=num_links_from_search, workers=search_workers):
+                print(f"google search url: {url}")
+                seen.add(url)
+                yield url
+        for url in url_list:
+            if normalize_url(url) not in seen:
+                print(f"passed url: {url}")
+                yield url
+
+    if concurrent:
+        # Threads start fetching as soon as the first page of search results is in
+        print("All reddits selected:")
+        reddit_threads_list = scrape_threads_concurrently(
+            search_query, candidate_urls(), fetch_post, classify_posts, scrape_comments,
+            relevance_batch_size=relevance_batch_size,
+            fetch_workers=fetch_workers,
+            check_workers=check_workers,
+            scrape_workers=scrape_workers,
+            domain_delay=domain_delay,
+        )
+    else:
+        all_urls = list(candidate_urls())
+        print("")
+        print("All urls:")
+        print(all_urls)
+        print("All reddits selected:")
+        reddit_urls = [(thread_idx, thread_url) for thread_idx, thread_url in enumerate(all_urls) if REDDIT_URL_MARKER in thread_url]
+        for batch_start in range(0, len(reddit_urls), relevance_batch_size):
+            batch = reddit_urls[batch_start:batch_start + relevance_batch_size]
+            posts = [fetch_post(thread_url) for _, thread_url in batch]
+            good_thread_checks = classify_posts(search_query, posts)
+            for (thread_idx, thread_url), (post_title, post_body), good_thread_check in zip(batch, posts, good_thread_checks):
+                print(thread_url, good_thread_check)
+                #print(search_query, post_title, post_body)
+                if "YES" in good_thread_check:
+                    print(thread_url, post_title)
+                    sleep(random.uniform(1, 2))
+                    # Example usage
+                    #thread_url = 'https://www.reddit.com/r/wine/comments/18fn4fg/favorite_bottle_of_wine_under_20/'
+                    print(thread_url)
+                    comments = scrape_comments(thread_url)
+                    reddit_threads_list.append((thread_idx, comments))
+    return reddit_threads_list
+
+
+def build_analysis_prompt(search_query, reddit_threads_list):
     reddit_threads_str = "".join(reddit_threads_list)
 
     prompt = f"""
@@ -492,38 +1338,339 @@ def reddit_to_llm(search_query=None, url_list=None, num_links_from_search=10):
     return prompt
 
 
-if __name__=="__main__":
-    args = parse_args()
-    search_query = args.search_query
-    num_links_from_search = args.num_links_from_search
-    url_list = args.url_list if args.url_list else []
-    if args.cache_prompt:
-        with open(args.cache_prompt, 'r') as f:
-            prompt = f.read()
-    else:
-        prompt = reddit_to_llm(search_query=search_query, url_list=url_list, num_links_from_search=num_links_from_search)
-        current_datetime = datetime.now().strftime('%Y%m%d_%H%M%S')
-        file_name = f"prompt_{current_datetime}.txt"
-        home_dir = os.path.expanduser("~")
-        file_path = os.path.join(home_dir, "Downloads", file_name)
-        with open(file_path, 'w') as f:
-            f.write(prompt)
-
-
-    print(prompt)
-    print(calculate_token_count(prompt))
-    if calculate_token_count(prompt) > 200000:
-        print("OVER LIMIT")
-
-    message = client.messages.create(
-        model="claude-3-5-sonnet-20240620",
-        max_tokens=1000,
+DEFAULT_LATENCY_LOG = os.path.join(os.path.expanduser("~"), ".cache", "search_reddit", "latency.jsonl")
+
+
+def stream_analysis(prompt, model=ANALYSIS_MODEL, max_tokens=1000, console=None):
+    """
+    Stream the analysis, re-rendering the markdown as tokens arrive.
+    Returns:
+    - tuple: (full response text, metrics dict with time to first token, generation time and throughput).
+    """
+    from rich.console import Console
+    from rich.live import Live
+    from rich.markdown import Markdown
+    console = console or Console()
+    chunks = []
+    first_token_time = None
+    start = time.perf_counter()
+    with get_client().messages.stream(
+        model=model,
+        max_tokens=max_tokens,
         temperature=0.0,
         messages=[
             {"role": "user", "content": prompt}
         ]
+    ) as stream, Live(Markdown(""), console=console, refresh_per_second=8) as live:
+        for text in stream.text_stream:
+            if first_token_time is None:
+                first_token_time = time.perf_counter()
+            chunks.append(text)
+            live.update(Markdown("".join(chunks)))
+        final_message = stream.get_final_message()
+    end = time.perf_counter()
+    first_token_time = first_token_time or end
+    generation_seconds = end - first_token_time
+    output_tokens = final_message.usage.output_tokens
+    metrics = {
+        'model': model,
+        'time_to_first_token': first_token_time - start,
+        'generation_seconds': generation_seconds,
+        'total_seconds': end - start,
+        'input_tokens': final_message.usage.input_tokens,
+        'output_tokens': output_tokens,
+        'tokens_per_second': output_tokens / generation_seconds if generation_seconds > 0 else None,
+    }
+    return "".join(chunks), metrics
+
+
+def record_latency_metrics(path, metrics, **context):
+    """ Append one run's metrics as a JSON line so latency can be tracked across runs. """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(json.dumps({'timestamp': datetime.now().isoformat(), **context, **metrics}) + "\n")
+
+
+def setup_shared_resources(args):
+    """ Build the HTTP pool, token counter and cache that every query of this process shares. """
+    global http, token_counter, cache
+    http = Fetcher(headers=REDDIT_HEADERS, timeout=(5, args.http_timeout), host_delay=args.http_host_delay, profiler=profiler)
+    if args.token_counter == "anthropic":
+        token_counter = TokenCounter(backend="anthropic", client=get_client(), model=ANALYSIS_MODEL)
+    if not args.no_cache:
+        cache = PersistentCache(
+            args.cache_path,
+            max_bytes=args.cache_max_mb * 1024 * 1024,
+            ttls={name: float(seconds) for name, seconds in (ttl.split("=", 1) for ttl in args.cache_ttls)},
+        )
+
+
+def build_prompt(search_query, url_list, num_links_from_search, args, driver_pool=None):
+    return reddit_to_llm(
+        search_query=search_query,
+        url_list=url_list,
+        num_links_from_search=num_links_from_search,
+        concurrent=args.concurrent,
+        fetch_workers=args.fetch_workers,
+        check_workers=args.check_workers,
+        scrape_workers=args.scrape_workers,
+        domain_delay=args.domain_delay,
+        driver_pool=driver_pool,
+        driver_pool_size=args.driver_pool_size,
+        headless=args.headless,
+        extraction_mode=args.extraction_mode,
+        scrape_backend=args.scrape_backend,
+        relevance_model=args.relevance_model,
+        relevance_batch_size=args.relevance_batch_size,
+        # Map-reduce splits the threads itself, so nothing needs to be dropped to fit
+        token_budget=args.token_budget if args.analysis_mode == "single" else None,
+        search_workers=args.search_workers,
+        refresh=args.refresh,
     )
-    console = Console()
-    md = Markdown(message.content[0].text)
-    console.print(md)
 
+
+def save_prompt(prompt, suffix=""):
+    current_datetime = datetime.now().strftime('%Y%m%d_%H%M%S')
+    file_name = f"prompt_{current_datetime}{suffix}.txt"
+    home_dir = os.path.expanduser("~")
+    file_path = os.path.join(home_dir, "Downloads", file_name)
+    with open(file_path, 'w') as f:
+        f.write(prompt)
+    return file_path
+
+
+def analyze_prompt(prompt, search_query, prompt_tokens, args, stream=False, console=None):
+    """ Run the final analysis of `prompt`; returns the analysis and the metrics of any streamed requests. """
+    stream_metrics = []
+
+    def finalize(final_prompt):
+        with profiler.span('analysis_llm', model=ANALYSIS_MODEL, stream=stream) as span:
+            if not stream:
+                message = get_client().messages.create(
+                    model=ANALYSIS_MODEL,
+                    max_tokens=1000,
+                    temperature=0.0,
+                    messages=[
+                        {"role": "user", "content": final_prompt}
+                    ]
+                )
+                record_usage(span, message.usage)
+                return message.content[0].text
+            text, metrics = stream_analysis(final_prompt, model=ANALYSIS_MODEL, console=console)
+            span.update(input_tokens=metrics['input_tokens'], output_tokens=metrics['output_tokens'],
+                        time_to_first_token=metrics['time_to_first_token'])
+            stream_metrics.append(metrics)
+            return text
+
+    if args.analysis_mode == "map_reduce":
+        prompt_query, reddit_threads_list = split_prompt_threads(prompt)
+        # Includes the final reduce, which is also recorded as its own analysis_llm span
+        with profiler.span('map_reduce', threads=len(reddit_threads_list)):
+            analysis = map_reduce_analysis(
+                get_client(), search_query or prompt_query, reddit_threads_list, estimate_token_count, ANALYSIS_MODEL,
+                chunk_tokens=args.map_chunk_tokens,
+                concurrency=args.map_concurrency,
+                max_retries=args.max_retries,
+                finalize=finalize,
+            )
+    else:
+        if args.token_budget and prompt_tokens > args.token_budget:
+            print("OVER LIMIT")
+        analysis = finalize(prompt)
+    return analysis, stream_metrics
+
+
+def read_queries(path):
+    """
+    Queries for batch mode from `path` ('-' for stdin), one per line: a plain search query, or
+    a JSON object with `search_query` and optionally `url_list` and `num_links_from_search`.
+    Blank lines and lines starting with # are skipped.
+    """
+    f = sys.stdin if path == "-" else open(path, 'r')
+    try:
+        queries = []
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            queries.append(json.loads(line) if line.startswith("{") else {'search_query': line})
+        return queries
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def run_query(query, args, driver_pool=None, index=None):
+    """
+    Build and analyze the prompt for one batch or service query; returns its result record.
+    Failures are recorded in the result's `error` instead of raised, so one bad query does not
+    stop the others.
+    """
+    search_query = query.get('search_query')
+    url_list = query.get('url_list') or []
+    result = {'index': index, 'search_query': search_query, 'url_list': url_list,
+              'started_at': datetime.now().isoformat(timespec='seconds')}
+    start = time.perf_counter()
+    try:
+        if not search_query and not url_list:
+            raise ValueError("A query needs a search_query or a url_list")
+        # Fetched documents are memoized for this query only, so later queries see fresh copies
+        with http.memo_scope(), profiler.span('query', search_query=search_query):
+            prompt = build_prompt(search_query, url_list, query.get('num_links_from_search', args.num_links_from_search),
+                                  args, driver_pool=driver_pool)
+            prompt_tokens = calculate_token_count(prompt)
+            analysis, _ = analyze_prompt(prompt, search_query, prompt_tokens, args)
+        result.update(
+            threads=len(split_prompt_threads(prompt)[1]),
+            prompt_tokens=prompt_tokens,
+            prompt_file=save_prompt(prompt, suffix="" if index is None else f"_{index}"),
+            analysis=analysis,
+        )
+    except Exception as e:
+        print(f"Query {search_query or url_list!r} failed: {e}")
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+class ResultWriter:
+    """ Appends result records to a JSONL file, one line per query, from any thread. """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.written = 0
+
+    def write(self, result):
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(result) + "\n")
+            self.written += 1
+
+
+def run_batch(queries, args, writer, driver_pool=None):
+    """ Run `queries` with up to `args.query_workers` at a time, writing each result as it finishes. """
+    with ThreadPoolExecutor(max_workers=max(1, args.query_workers)) as executor:
+        futures = [executor.submit(run_query, query, args, driver_pool, index) for index, query in enumerate(queries)]
+        for future in as_completed(futures):
+            result = future.result()
+            writer.write(result)
+            status = f"error: {result['error']}" if 'error' in result else f"{result['threads']} threads"
+            print(f"[{writer.written}/{len(queries)}] {result['search_query'] or result['url_list']}: {status} in {result['seconds']:.1f}s")
+
+
+def serve(port, args, writer, driver_pool=None):
+    """
+    Answer queries over local HTTP until interrupted, with the client, browsers, HTTP pool and
+    caches kept warm between them:
+
+        POST /query   {"search_query": ..., "url_list": [...]}  -> the result record
+        GET  /health  -> queries answered so far and cache stats
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    # Each request gets its own thread; this bounds how many queries run at once
+    slots = threading.BoundedSemaphore(max(1, args.query_workers))
+    # Requests can answer at the same time, so result indices come from a shared counter
+    indices = itertools.count()
+    index_lock = threading.Lock()
+    profiler.limit_spans(MAX_SERVE_SPANS)
+
+    class QueryHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if urlparse(self.path).path != "/health":
+                return self.send_json(404, {'error': "not found"})
+            self.send_json(200, {'status': "ok", 'queries': writer.written,
+                                 'cache': cache.stats() if cache is not None else None})
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/query":
+                return self.send_json(404, {'error': "not found"})
+            try:
+                query = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                if not isinstance(query, dict):
+                    raise ValueError("expected a JSON object")
+            except ValueError as e:
+                return self.send_json(400, {'error': f"Invalid query: {e}"})
+            with index_lock:
+                index = next(indices)
+            with slots:
+                result = run_query(query, args, driver_pool, index=index)
+            writer.write(result)
+            self.send_json(500 if 'error' in result else 200, result)
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), QueryHandler)
+    print(f"Serving queries on http://127.0.0.1:{server.server_address[1]}/query (results in {writer.path})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__=="__main__":
+    args = parse_args()
+    search_query = args.search_query
+    num_links_from_search = args.num_links_from_search
+    url_list = args.url_list if args.url_list else []
+    # Closed at the end of the run, so the profile covers everything in between
+    run_profile = ExitStack()
+    run_profile.enter_context(profile_code(args.profiler, args.profiler_output))
+    setup_shared_resources(args)
+    if args.query_file or args.serve is not None:
+        # One process for many queries: browsers are launched once and shared by all of them
+        driver_pool = None
+        if args.driver_pool_size > 0:
+            driver_pool = run_profile.enter_context(DriverPool(size=args.driver_pool_size, headless=args.headless))
+        writer = ResultWriter(args.output_jsonl)
+        if args.query_file:
+            run_batch(read_queries(args.query_file), args, writer, driver_pool=driver_pool)
+        else:
+            serve(args.serve, args, writer, driver_pool=driver_pool)
+        if cache is not None:
+            print("cache:", cache.stats())
+        if args.refresh:
+            print("refresh:", format_refresh_counts(refresh_counts))
+        print(f"{writer.written} results written to {args.output_jsonl}")
+    else:
+        if args.cache_prompt:
+            with open(args.cache_prompt, 'r') as f:
+                prompt = f.read()
+        else:
+            prompt = build_prompt(search_query, url_list, num_links_from_search, args)
+            save_prompt(prompt)
+        if cache is not None:
+            print("cache:", cache.stats())
+        if args.refresh and not args.cache_prompt:
+            print("refresh:", format_refresh_counts(refresh_counts))
+
+        print(prompt)
+        prompt_tokens = calculate_token_count(prompt)
+        print(prompt_tokens)
+        from rich.console import Console
+        from rich.markdown import Markdown
+        console = Console()
+        analysis, stream_metrics = analyze_prompt(prompt, search_query, prompt_tokens, args, stream=args.stream, console=console)
+        if not stream_metrics:
+            md = Markdown(analysis)
+            console.print(md)
+        for metrics in stream_metrics:
+            print(f"time to first token: {metrics['time_to_first_token']:.2f}s, "
+                  f"generation: {metrics['generation_seconds']:.2f}s, "
+                  f"{metrics['output_tokens']} tokens ({metrics['tokens_per_second'] or 0:.1f} tokens/s)")
+            record_latency_metrics(args.latency_log, metrics, search_query=search_query, analysis_mode=args.analysis_mode)
+    run_profile.close()
+    if args.profile_report:
+        profiler.print_summary()
+        profiler.write_report(args.profile_report, search_query=search_query, args=vars(args))
+        print(f"Profile report written to {args.profile_report}")
@@ -0,0 +1,74 @@
+"""
+Per-thread comment snapshots for incremental refreshes.
+
+A snapshot is a thread's comment tree as it was last scraped, with each comment's Reddit
+fullname (`t1_...`) in 'id': the tree cached under the 'comments' namespace, which is
+retained past its TTL for this (see reddit_cache.py). A refresh still reads the thread's
+first page of comments, so those comments come back with current scores. Collapsed
+comments behind "more" stubs are only requested through /api/morechildren when their ids
+are not in the snapshot; the others are taken from the snapshot with their stored scores.
+"""
+from collections import Counter
+
+from comment_store import parse_score
+
+
+def index_snapshot(comments):
+    """
+    id -> (comment, parent id, pre-order position) for every comment with an id. The parent is
+    the nearest ancestor with an id: None for roots, and '' below an id-less root, so those
+    comments are never mistaken for roots.
+    """
+    index = {}
+    stack = [(comment, None) for comment in reversed(comments)]
+    while stack:
+        comment, parent_id = stack.pop()
+        if comment.get('id'):
+            index[comment['id']] = (comment, parent_id, len(index))
+        reply_parent = comment.get('id') or parent_id or ''
+        stack.extend((reply, reply_parent) for reply in reversed(comment['replies']))
+    return index
+
+
+def copy_comment(comment, with_replies=False):
+    """ Copy of `comment`, with copies of all its replies if `with_replies`; iterative, so any depth works. """
+    def shallow(source):
+        return {'id': source.get('id'), 'text': source['text'], 'score': source['score'], 'replies': []}
+
+    copy = shallow(comment)
+    stack = [(comment, copy)] if with_replies else []
+    while stack:
+        source, target = stack.pop()
+        for reply in source['replies']:
+            reply_copy = shallow(reply)
+            target['replies'].append(reply_copy)
+            stack.append((reply, reply_copy))
+    return copy
+
+
+def count_fetched(counts, known, comment):
+    """ Count a freshly fetched comment as 'new', or as 'refreshed' (and 'rescored' if its score moved). """
+    previous = known.get(comment.get('id'))
+    if previous is None:
+        counts['new'] += 1
+        return
+    counts['refreshed'] += 1
+    if parse_score(previous[0]['score']) != parse_score(comment['score']):
+        counts['rescored'] += 1
+
+
+def compare_to_snapshot(known, comments):
+    """ Counts for a tree that was scraped in full (e.g. by the browser) against the snapshot index `known`. """
+    counts = Counter()
+    stack = list(comments)
+    while stack:
+        comment = stack.pop()
+        count_fetched(counts, known, comment)
+        stack.extend(comment['replies'])
+    return counts
+
+
+def format_refresh_counts(counts):
+    known = counts['refreshed'] + counts['reused']
+    return (f"{counts['new']} new, {known} known ({counts['reused']} reused from the snapshot, "
+            f"{counts['rescored']} with a new score)")
@@ -0,0 +1,96 @@
+"""
+Token counting for the analysis prompt and its parts.
+
+The cl100k encoder is loaded once per process and recent counts are memoized, so counting
+the same prompt twice costs one encode. Counts can be accumulated per comment and per thread
+as content is scraped (RunningTokenCount) and computed for many texts at once on a thread
+pool. With `backend="anthropic"` the counts come from Anthropic's own tokenizer instead, since
+cl100k only approximates Claude's. That can be an API call, so small pieces (single comments,
+truncations) are always sized locally with `estimate`, and only whole prompts and threads
+go through `count`.
+"""
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def get_encoding(name="cl100k_base"):
+    import tiktoken  # Imported on first use; the anthropic backend never needs it
+    return tiktoken.get_encoding(name)
+
+
+class TokenCounter:
+    def __init__(self, backend="tiktoken", client=None, model=None, encoding_name="cl100k_base",
+                 workers=4, memo_size=1024):
+        if backend == "anthropic" and client is None:
+            raise ValueError("The anthropic token counting backend needs a client")
+        self.backend = backend
+        self.client = client
+        self.model = model
+        self.encoding_name = encoding_name
+        self.workers = workers
+        self.memo_size = memo_size
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _count_uncached(self, text):
+        if self.backend == "anthropic":
+            # Newer SDKs count through the API for the exact model; older ones ship a local tokenizer
+            count_tokens = getattr(self.client.messages, "count_tokens", None)
+            if count_tokens is not None:
+                return count_tokens(model=self.model, messages=[{"role": "user", "content": text}]).input_tokens
+            return self.client.count_tokens(text)
+        return len(get_encoding(self.encoding_name).encode(text, disallowed_special=()))
+
+    def count(self, text):
+        with self._lock:
+            if text in self._memo:
+                self._memo.move_to_end(text)
+                return self._memo[text]
+        tokens = self._count_uncached(text)
+        with self._lock:
+            self._memo[text] = tokens
+            if len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return tokens
+
+    def estimate(self, text):
+        """ Local cl100k count, never a network call; the same as `count` for the tiktoken backend. """
+        if self.backend == "tiktoken":
+            return self.count(text)
+        return len(get_encoding(self.encoding_name).encode(text, disallowed_special=()))
+
+    def count_batch(self, texts):
+        """ Count many texts in parallel; returns counts in the same order. """
+        if self.backend == "tiktoken":
+            encoded = get_encoding(self.encoding_name).encode_batch(
+                list(texts), num_threads=self.workers, disallowed_special=()
+            )
+            return [len(tokens) for tokens in encoded]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(self.count, texts))
+
+
+class RunningTokenCount:
+    """
+    Running token total for a prompt that is assembled piece by piece, e.g. comment by comment
+    from scrape workers, so the total is known without re-encoding the whole prompt. Pieces
+    are sized with the counter's local estimate one at a time, so the total is for progress
+    reports only: it can differ from a full or remote count of the prompt.
+    """
+
+    def __init__(self, counter):
+        self.counter = counter
+        self.total = 0
+        self.per_key = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add_pieces(self, texts, key=None):
+        """ Add many small pieces (e.g. one per comment), each sized locally with `estimate`. """
+        tokens = sum(self.counter.estimate(text) for text in texts)
+        with self._lock:
+            self.total += tokens
+            self.per_key[key] += tokens
+            return self.total